@@ -1,7 +1,8 @@
 import os
 import random
 import time
-from typing import Optional, Tuple
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 
 import gym
 import numpy as np
@@ -9,56 +10,80 @@ from stable_baselines3 import DQN
 from stable_baselines3.dqn import MlpPolicy
 
 from .board import Board, Move, BOARD_HEIGHT, BOARD_WIDTH
-from .rules import legal_moves
-from .pieces import PieceType
+from .rules import DrawRule, LegalMoveCache, PositionHistory, is_legal, legal_moves
+from .pieces import CASTLE_CODES, PieceType
+from .positions import PositionIndex
+from .mcts import MCTS, MODEL_PATH as MCTS_MODEL_PATH, MaterialEvaluator, NetworkEvaluator
+from .evaluation import WIN_SCORE, Evaluator, load_default
+from .zobrist import SIDE_KEY, position_hash, update_hash
+
+# Capture value of each square code, used for move ordering
+CAPTURE_VALUES = [0, 1, 1, 2.5, 1000, 1, 1, 2.5, 1000]
+DRAW_SCORE = 0.0
+# Width of the null windows, below the 0.1 evaluation step
+WINDOW = 0.01
+NULL_MOVE_REDUCTION = 2
+NULL_MOVE_MIN_DEPTH = 3
+LMR_MIN_MOVES = 3
+LMR_MIN_DEPTH = 3
+FUTILITY_MARGIN = 1.5
+RAZOR_MARGIN = 3.0
+
+ENGINES = ("minimax", "mcts", "rl")
+# MCTS playouts per unit of power
+MCTS_PLAYOUTS = 200
+# Depth limit of analyze when only a time limit is given
+MAX_ANALYSIS_DEPTH = 64
 
 class MedChessEnv(gym.Env):
     metadata = {'render.modes': ['human']}
-    def __init__(self):
+    def __init__(self, draw_rule: Optional[DrawRule] = None):
         super().__init__()
         self.board = Board()
         self.current_player = 0
+        self.draw_rule = draw_rule or DrawRule()
+        self.history = PositionHistory(self.board, self.current_player, self.draw_rule)
         self.action_space = gym.spaces.Discrete(BOARD_WIDTH * BOARD_HEIGHT * BOARD_WIDTH * BOARD_HEIGHT)
         self.observation_space = gym.spaces.Box(low=0, high=8, shape=(BOARD_HEIGHT, BOARD_WIDTH), dtype=np.int8)
         self.done = False
 
     def reset(self):
-        self.board.reset()
+        # A fresh board: observations already returned are views of the old
+        # buffer and must keep showing the final position of the episode
+        self.board = Board()
         self.current_player = 0
+        self.history = PositionHistory(self.board, self.current_player, self.draw_rule)
         self.done = False
         return self._get_obs()
 
     def _get_obs(self):
-        arr = np.zeros((BOARD_HEIGHT, BOARD_WIDTH), dtype=np.int8)
-        for r in range(BOARD_HEIGHT):
-            for c in range(BOARD_WIDTH):
-                piece = self.board.get_piece(r, c)
-                if piece:
-                    code = {
-                        PieceType.SWORDSMAN: 1,
-                        PieceType.KNIGHT: 2,
-                        PieceType.GENERAL: 3,
-                        PieceType.CASTLE: 4,
-                    }[piece.type]
-                    arr[r, c] = code if piece.player == 0 else code + 4
-        return arr
+        # Zero-copy view of the board buffer: it follows later moves, so
+        # callers that keep an observation must copy it
+        return np.frombuffer(self.board.cells, dtype=np.int8).reshape(BOARD_HEIGHT, BOARD_WIDTH)
 
     def step(self, action: int):
         if self.done:
             return self._get_obs(), 0.0, True, {}
         move = self._decode_action(action)
-        if move not in legal_moves(self.board, self.current_player):
+        if not is_legal(self.board, move, self.current_player):
             self.done = True
-            return self._get_obs(), -1.0, True, {}
+            return self._get_obs(), -1.0, True, {"illegal": True}
         fr, fc, tr, tc = move
         target = self.board.get_piece(tr, tc)
+        self.history.push(self.board, move)
         self.board.move_piece(move)
         reward = 0.0
+        info = {}
         if target and target.type == PieceType.CASTLE:
             self.done = True
             reward = 1.0
+        else:
+            draw = self.history.draw_reason()
+            if draw is not None:
+                self.done = True
+                info["draw"] = draw
         self.current_player = 1 - self.current_player
-        return self._get_obs(), reward, self.done, {}
+        return self._get_obs(), reward, self.done, info
 
     def render(self, mode='human'):
         print(self.board.render())
@@ -79,6 +104,22 @@ def train(path: str, timesteps: int = 10000) -> None:
     model.learn(total_timesteps=timesteps)
     model.save(path)
 
+@dataclass
+class AnalysisLine:
+    move: Move
+    # From the point of view of the player to move
+    score: float
+    pv: List[Move]
+
+
+@dataclass
+class AnalysisStep:
+    depth: int
+    lines: List[AnalysisLine] = field(default_factory=list)
+    nodes: int = 0
+    elapsed: float = 0.0
+
+
 class AIPlayer:
     PERSONALITIES = ["Aggressive", "Equilibré", "Défensif"]
     OPENINGS = {
@@ -87,107 +128,188 @@ class AIPlayer:
         "Défensif": [(0, 0, 1, 1)],
     }
 
-    def __init__(self, model_path: str):
-        if os.path.exists(model_path):
-            self.model = DQN.load(model_path)
-        else:
-            train(model_path, 1000)
+    def __init__(
+        self,
+        model_path: Optional[str],
+        personality: Optional[str] = None,
+        verbose: bool = True,
+        book_path: Optional[str] = None,
+        book_min_games: int = 10,
+        null_move: bool = True,
+        lmr: bool = True,
+        futility: bool = True,
+        razoring: bool = True,
+        mcts_model_path: Optional[str] = MCTS_MODEL_PATH,
+        mcts_batch_size: int = 16,
+        weights_path: Optional[str] = None,
+    ):
+        # Without a model path only the minimax engine is available
+        self.model = None
+        if model_path is not None:
+            if not os.path.exists(model_path):
+                train(model_path, 1000)
             self.model = DQN.load(model_path)
         self.env = MedChessEnv()
-        self.personality = random.choice(self.PERSONALITIES)
+        # Built on first use, keeps its tree between moves
+        self.mcts: Optional[MCTS] = None
+        self.new_game(personality)
+        # Piece-square tables, tuned ones from medchess/weights.json if present
+        self.evaluator = Evaluator.load(weights_path) if weights_path else load_default()
+        # Position index built from recorded games, used as an opening book
+        self.book = PositionIndex(book_path) if book_path else None
+        self.book_min_games = book_min_games
+        # Shared across searches: iterative deepening revisits the same nodes
+        self.legal_cache = LegalMoveCache()
+        # Selective search, each technique can be switched off to measure it
+        self.null_move = null_move
+        self.lmr = lmr
+        self.futility = futility
+        self.razoring = razoring
+        # Statistics of the last choose_move search
+        self.nodes = 0
+        self.last_depth = 0
+        self._root_best: Optional[Move] = None
+        # Hashes of the game history and of the line being searched
+        self._path: Dict[int, int] = {}
+        # Principal variation of each ply, only collected by analyze
+        self._pv: Optional[Dict[int, List[Move]]] = None
+        self.mcts_model_path = mcts_model_path
+        self.mcts_batch_size = mcts_batch_size
+        if verbose:
+            print(f"Personnalité de l'IA : {self.personality}")
+
+    def new_game(self, personality: Optional[str] = None) -> None:
+        # Forget the previous game, models and caches are kept
+        if personality is None:
+            personality = random.choice(self.PERSONALITIES)
+        elif personality not in self.PERSONALITIES:
+            raise ValueError(f"Unknown personality: {personality}")
+        self.personality = personality
         self.turn_count = 0
-        print(f"Personnalité de l'IA : {self.personality}")
+        if self.mcts is not None:
+            self.mcts.root = None
 
     def _evaluate(self, board: Board, player: int) -> float:
-        values = {
-            PieceType.SWORDSMAN: 1,
-            PieceType.KNIGHT: 1,
-            PieceType.GENERAL: 2.5,
-            PieceType.CASTLE: 1000,
-        }
-        score = 0.0
-        has_castle = [False, False]
-        for r in range(BOARD_HEIGHT):
-            for c in range(BOARD_WIDTH):
-                piece = board.get_piece(r, c)
-                if piece:
-                    if piece.type == PieceType.CASTLE:
-                        has_castle[piece.player] = True
-                    val = values[piece.type]
-                    if piece.type != PieceType.CASTLE:
-                        if piece.type == PieceType.SWORDSMAN:
-                            start_row = BOARD_HEIGHT - 2 if piece.player == 0 else 1
-                        else:
-                            start_row = BOARD_HEIGHT - 1 if piece.player == 0 else 0
-                        if piece.player == 0:
-                            val += (start_row - r) * 0.1
-                        else:
-                            val += (r - start_row) * 0.1
-                    if piece.player == player:
-                        score += val
-                    else:
-                        score -= val
-        if not has_castle[player]:
-            return -1000
-        if not has_castle[1 - player]:
-            return 1000
-        return score
+        return self.evaluator.evaluate(board, player)
 
     def _search(
         self,
         board: Board,
         player: int,
         depth: int,
+        alpha: float,
+        beta: float,
         start: float,
         max_time: Optional[int],
-        maximizing: bool,
-        root_player: int,
+        h: int,
+        ply: int = 0,
+        allow_null: bool = True,
     ) -> Tuple[float, Optional[Move]]:
+        # Negamax alpha-beta: scores are from the point of view of ``player``
+        self.nodes += 1
         if max_time is not None and time.time() - start >= max_time:
             raise TimeoutError
-        if depth == 0:
-            return self._evaluate(board, root_player), None
-        moves = legal_moves(board, player)
-        values_capture = {
-            PieceType.SWORDSMAN: 1,
-            PieceType.KNIGHT: 1,
-            PieceType.GENERAL: 2.5,
-            PieceType.CASTLE: 1000,
-        }
+        pv = self._pv
+        if pv is not None:
+            pv[ply] = []
+        if ply > 0 and h in self._path:
+            # Back to a position of the game or of the current line
+            return DRAW_SCORE, None
+        cells = board.cells
+        if depth <= 0 or CASTLE_CODES[0] not in cells or CASTLE_CODES[1] not in cells:
+            return self._evaluate(board, player), None
+        moves = list(self.legal_cache.moves(board, player, h))
+        if not moves:
+            return self._evaluate(board, player), None
+
         def capture_value(mv: Move) -> float:
-            fr, fc, tr, tc = mv
-            target = board.get_piece(tr, tc)
-            return values_capture.get(target.type, 0) if target else 0
+            return CAPTURE_VALUES[cells[mv[2] * BOARD_WIDTH + mv[3]]]
         moves.sort(key=capture_value, reverse=True)
-        if not moves:
-            return self._evaluate(board, root_player), None
+        if ply == 0 and self._root_best in moves:
+            moves.remove(self._root_best)
+            moves.insert(0, self._root_best)
+
+        static = None
+        if ply > 0 and abs(beta) < WIN_SCORE:
+            static = self._evaluate(board, player)
+            if self.razoring and depth <= 2 and static + RAZOR_MARGIN * depth <= alpha:
+                # Hopeless near the leaves: fail low at the frontier, or
+                # look one ply less deep just above it
+                if depth == 1:
+                    return static, None
+                depth -= 1
+            if (
+                self.null_move
+                and allow_null
+                and depth >= NULL_MOVE_MIN_DEPTH
+                and static >= beta
+            ):
+                # Let the opponent move twice; if we still hold beta, verify
+                # with a reduced search of our own before cutting off
+                reduced = depth - 1 - NULL_MOVE_REDUCTION
+                val, _ = self._search(
+                    board, 1 - player, reduced, -beta, -beta + WINDOW,
+                    start, max_time, h ^ SIDE_KEY, ply + 1, False,
+                )
+                if -val >= beta:
+                    val, _ = self._search(
+                        board, player, reduced, beta - WINDOW, beta,
+                        start, max_time, h, ply, False,
+                    )
+                    if val >= beta:
+                        return val, None
+
+        futile = (
+            self.futility
+            and static is not None
+            and depth == 1
+            and static + FUTILITY_MARGIN <= alpha
+        )
+        best_val = -float("inf")
         best_move = None
-        if maximizing:
-            best_val = -float("inf")
-            for mv in moves:
-                nb = board.copy()
-                nb.move_piece(mv)
-                try:
-                    val, _ = self._search(nb, 1 - player, depth - 1, start, max_time, False, root_player)
-                except TimeoutError:
-                    raise
-                if val > best_val:
-                    best_val = val
-                    best_move = mv
-            return best_val, best_move
-        else:
-            best_val = float("inf")
-            for mv in moves:
-                nb = board.copy()
-                nb.move_piece(mv)
-                try:
-                    val, _ = self._search(nb, 1 - player, depth - 1, start, max_time, True, root_player)
-                except TimeoutError:
-                    raise
-                if val < best_val:
-                    best_val = val
-                    best_move = mv
-            return best_val, best_move
+        # On timeout the path is left dirty, choose_move rebuilds it per depth
+        path = self._path
+        path[h] = path.get(h, 0) + 1
+        for i, mv in enumerate(moves):
+            quiet = capture_value(mv) == 0
+            if futile and quiet:
+                # A quiet move cannot lift this position back above alpha
+                if static > best_val:
+                    best_val = static
+                continue
+            nb = board.copy()
+            nb.move_piece(mv)
+            nh = update_hash(h, board, mv)
+            if (
+                self.lmr
+                and quiet
+                and i >= LMR_MIN_MOVES
+                and depth >= LMR_MIN_DEPTH
+                and ply > 0
+            ):
+                # Late quiet moves are searched shallower first and only
+                # re-searched at full depth if they beat alpha
+                val, _ = self._search(nb, 1 - player, depth - 2, -alpha - WINDOW, -alpha, start, max_time, nh, ply + 1)
+                val = -val
+                if val > alpha:
+                    val, _ = self._search(nb, 1 - player, depth - 1, -beta, -alpha, start, max_time, nh, ply + 1)
+                    val = -val
+            else:
+                val, _ = self._search(nb, 1 - player, depth - 1, -beta, -alpha, start, max_time, nh, ply + 1)
+                val = -val
+            if val > best_val:
+                best_val = val
+                best_move = mv
+            if val > alpha:
+                alpha = val
+                if pv is not None:
+                    pv[ply] = [mv] + pv[ply + 1]
+            if alpha >= beta:
+                break
+        path[h] -= 1
+        if not path[h]:
+            del path[h]
+        return best_val, best_move
 
     def choose_move(
         self,
@@ -195,7 +317,10 @@ class AIPlayer:
         player: int,
         power: int = 1,
         max_time: Optional[int] = None,
+        history: Optional[Iterable[int]] = None,
     ) -> Optional[Move]:
+        # ``history`` holds the hashes of the positions already reached in
+        # the game (PositionHistory.hashes); returning to one scores a draw
         power = max(1, min(10, power))
         moves = legal_moves(board, player)
 
@@ -205,12 +330,27 @@ class AIPlayer:
                 self.turn_count += 1
                 return opening
 
+        if self.book is not None:
+            book_move = self.book.best_move(board, player, self.book_min_games)
+            if book_move is not None:
+                self.turn_count += 1
+                return book_move
+
         start = time.time()
         best_move = None
+        h = position_hash(board, player)
+        history = list(history) if history is not None else []
+        self.nodes = 0
+        self._root_best = None
         for depth in range(1, power + 1):
+            self._path = {}
+            for seen in history:
+                self._path[seen] = self._path.get(seen, 0) + 1
             try:
-                val, move = self._search(board, player, depth, start, max_time, True, player)
+                val, move = self._search(board, player, depth, -float("inf"), float("inf"), start, max_time, h)
                 best_move = move if move is not None else best_move
+                self._root_best = best_move
+                self.last_depth = depth
             except TimeoutError:
                 break
         if best_move is not None:
@@ -221,13 +361,127 @@ class AIPlayer:
             return random.choice(moves)
         return None
 
+    def _analyze_depth(
+        self,
+        board: Board,
+        player: int,
+        moves: List[Move],
+        depth: int,
+        multipv: int,
+        start: float,
+        max_time: Optional[float],
+        h: int,
+        history: List[int],
+    ) -> Tuple[List[AnalysisLine], Dict[Move, float]]:
+        self._path = {h: 1}
+        for seen in history:
+            self._path[seen] = self._path.get(seen, 0) + 1
+        self._pv = {}
+        lines: List[AnalysisLine] = []
+        scores: Dict[Move, float] = {}
+        try:
+            for mv in moves:
+                # Each move only has to beat the current k-th best line; the
+                # scores of the moves that fail low are upper bounds
+                bound = lines[-1].score if len(lines) >= multipv else -float("inf")
+                nb = board.copy()
+                nb.move_piece(mv)
+                val, _ = self._search(
+                    nb, 1 - player, depth - 1, -float("inf"), -bound,
+                    start, max_time, update_hash(h, board, mv), 1,
+                )
+                val = -val
+                scores[mv] = val
+                if val > bound:
+                    lines.append(AnalysisLine(mv, val, [mv] + self._pv[1]))
+                    lines.sort(key=lambda line: line.score, reverse=True)
+                    del lines[multipv:]
+        finally:
+            self._pv = None
+        return lines, scores
+
+    def analyze(
+        self,
+        board: Board,
+        player: int,
+        depth: Optional[int] = None,
+        max_time: Optional[float] = None,
+        multipv: int = 1,
+        history: Optional[Iterable[int]] = None,
+    ) -> Iterator[AnalysisStep]:
+        """Iterative deepening yielding the ``multipv`` best lines at each depth.
+
+        Stops after ``depth`` plies or when ``max_time`` runs out; the depth
+        interrupted by the time limit is not yielded.
+        """
+        if depth is None and max_time is None:
+            raise ValueError("analyze needs a depth or a time limit")
+        start = time.time()
+        h = position_hash(board, player)
+        history = list(history) if history is not None else []
+        moves = list(legal_moves(board, player))
+        self.nodes = 0
+        scores: Dict[Move, float] = {}
+        for d in range(1, (depth or MAX_ANALYSIS_DEPTH) + 1):
+            # Best moves of the previous depth first, they set the bound early
+            moves.sort(key=lambda mv: scores.get(mv, -float("inf")), reverse=True)
+            try:
+                lines, scores = self._analyze_depth(
+                    board, player, moves, d, multipv, start, max_time, h, history,
+                )
+            except TimeoutError:
+                return
+            self.last_depth = d
+            yield AnalysisStep(d, lines, self.nodes, time.time() - start)
+
+    def choose_move_mcts(
+        self,
+        board: Board,
+        player: int,
+        power: int = 1,
+        max_time: Optional[int] = None,
+        history: Optional[Iterable[int]] = None,
+    ) -> Optional[Move]:
+        if self.mcts is None:
+            if self.mcts_model_path and os.path.exists(self.mcts_model_path):
+                evaluator = NetworkEvaluator.load(self.mcts_model_path)
+            else:
+                evaluator = MaterialEvaluator(self.evaluator)
+            self.mcts = MCTS(evaluator, batch_size=self.mcts_batch_size)
+        power = max(1, min(10, power))
+        move = self.mcts.search(
+            board, player, playouts=MCTS_PLAYOUTS * power, max_time=max_time, history=history
+        )
+        if move is not None:
+            self.turn_count += 1
+        return move
+
+    def select_move(
+        self,
+        engine: str,
+        board: Board,
+        player: int,
+        power: int = 1,
+        max_time: Optional[int] = None,
+        history: Optional[Iterable[int]] = None,
+    ) -> Optional[Move]:
+        if engine == "minimax":
+            return self.choose_move(board, player, power=power, max_time=max_time, history=history)
+        if engine == "mcts":
+            return self.choose_move_mcts(board, player, power=power, max_time=max_time, history=history)
+        if engine == "rl":
+            return self.choose_move_rl(board, player)
+        raise ValueError(f"Unknown engine: {engine}")
+
     def choose_move_rl(self, board: Board, player: int) -> Optional[Move]:
+        if self.model is None:
+            raise RuntimeError("No DQN model loaded")
         self.env.board = board.copy()
         self.env.current_player = player
         state = self.env._get_obs()
         action, _ = self.model.predict(state, deterministic=True)
         move = self.env._decode_action(int(action))
-        if move in legal_moves(board, player):
+        if is_legal(board, move, player):
             return move
         # If the predicted move is illegal, fall back to a random legal move
         moves = legal_moves(board, player)
@@ -0,0 +1,158 @@
+# Bulk analysis of positions
+#
+# Reads one position per line (notation.board_to_fen format), analyses them
+# on a process pool and writes one JSON line per position, in input order.
+# At most a fixed number of positions are in flight at once, so that memory
+# stays constant whatever the size of the input.
+import argparse
+import itertools
+import json
+from collections import deque
+import multiprocessing
+import os
+import sys
+from typing import Iterator, List, Optional, TextIO
+
+from .ai import AIPlayer, AnalysisStep
+from .notation import board_from_fen, move_to_str
+
+# Positions in flight per worker
+CHUNK_PER_WORKER = 8
+
+_player: Optional[AIPlayer] = None
+_settings: dict = {}
+
+
+def _init_worker(settings: dict) -> None:
+    global _player, _settings
+    _settings = settings
+    _player = AIPlayer(None, verbose=False, weights_path=settings["weights"])
+
+
+def step_to_json(step: AnalysisStep) -> dict:
+    return {
+        "depth": step.depth,
+        "nodes": step.nodes,
+        "time": round(step.elapsed, 4),
+        "lines": [
+            {
+                "move": move_to_str(line.move),
+                "score": round(line.score, 4) + 0.0,
+                "pv": [move_to_str(mv) for mv in line.pv],
+            }
+            for line in step.lines
+        ],
+    }
+
+
+def _analyze_line(text: str) -> str:
+    result: dict = {"position": text}
+    try:
+        board, player = board_from_fen(text)
+    except ValueError as exc:
+        result["error"] = str(exc)
+        return json.dumps(result)
+    steps = []
+    for step in _player.analyze(
+        board,
+        player,
+        depth=_settings["depth"],
+        max_time=_settings["max_time"],
+        multipv=_settings["multipv"],
+    ):
+        steps.append(step_to_json(step))
+    if steps:
+        result.update(steps[-1])
+    else:
+        result.update({"depth": 0, "lines": []})
+    if _settings["all_depths"]:
+        result["steps"] = steps
+    return json.dumps(result)
+
+
+def _read_positions(lines: Iterator[str]) -> Iterator[str]:
+    for line in lines:
+        line = line.strip()
+        if line and not line.startswith("#"):
+            yield line
+
+
+def analyze_file(
+    positions: TextIO,
+    out: TextIO,
+    depth: Optional[int] = None,
+    max_time: Optional[float] = None,
+    multipv: int = 1,
+    workers: Optional[int] = None,
+    all_depths: bool = False,
+    weights_path: Optional[str] = None,
+) -> int:
+    """Analyse every position of ``positions`` and write JSON lines to ``out``."""
+    if depth is None and max_time is None:
+        raise ValueError("A depth or a time limit is needed")
+    workers = workers or os.cpu_count() or 1
+    settings = {
+        "depth": depth,
+        "max_time": max_time,
+        "multipv": multipv,
+        "all_depths": all_depths,
+        "weights": weights_path,
+    }
+    source = _read_positions(positions)
+    window = workers * CHUNK_PER_WORKER
+    pending: deque = deque()
+    count = 0
+    with multiprocessing.Pool(workers, _init_worker, (settings,)) as pool:
+        for text in itertools.islice(source, window):
+            pending.append(pool.apply_async(_analyze_line, (text,)))
+        while pending:
+            # Write the oldest result and refill the window with one position
+            result = pending.popleft()
+            if not result.ready():
+                out.flush()
+            out.write(result.get() + "\n")
+            count += 1
+            text = next(source, None)
+            if text is not None:
+                pending.append(pool.apply_async(_analyze_line, (text,)))
+    out.flush()
+    return count
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Analyse un fichier de positions MedChess")
+    parser.add_argument("positions", help="Fichier avec une position par ligne, '-' pour l'entrée standard")
+    parser.add_argument("-depth", type=int, default=None, help="Profondeur d'analyse")
+    parser.add_argument("-time", type=float, default=None, help="Temps d'analyse par position en secondes")
+    parser.add_argument("-multipv", type=int, default=1, help="Nombre de meilleurs coups à donner")
+    parser.add_argument("-workers", type=int, default=None, help="Nombre de processus (tous les coeurs par défaut)")
+    parser.add_argument("-out", default=None, help="Fichier JSON lines à écrire (sortie standard par défaut)")
+    parser.add_argument("-all-depths", action="store_true", help="Donne aussi le résultat de chaque profondeur")
+    parser.add_argument("-weights", default=None, help="Fichier de poids de l'évaluation")
+    args = parser.parse_args(argv)
+    if args.depth is None and args.time is None:
+        parser.error("-depth ou -time est requis")
+
+    positions = sys.stdin if args.positions == "-" else open(args.positions, encoding="utf-8")
+    out = open(args.out, "w", encoding="utf-8") if args.out else sys.stdout
+    try:
+        count = analyze_file(
+            positions,
+            out,
+            depth=args.depth,
+            max_time=args.time,
+            multipv=args.multipv,
+            workers=args.workers,
+            all_depths=args.all_depths,
+            weights_path=args.weights,
+        )
+    finally:
+        if positions is not sys.stdin:
+            positions.close()
+        if out is not sys.stdout:
+            out.close()
+    print(f"{count} positions analysées", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,349 @@
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import random
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from .ai import ENGINES, AIPlayer, train
+from .board import Board, Move
+from .record import DRAW, GameRecord, RecordWriter
+from .rules import DrawRule, PositionHistory, legal_moves
+
+MODEL_PATH = os.path.join(os.path.dirname(__file__), "model.zip")
+
+
+@dataclass
+class EngineConfig:
+    power: int = 2
+    max_time: Optional[float] = None
+    personality: Optional[str] = None
+    engine: str = "minimax"
+    # Extra keyword arguments forwarded to AIPlayer
+    options: Dict[str, object] = field(default_factory=dict)
+
+
+@dataclass
+class Adjudication(DrawRule):
+    max_plies: int = 400
+
+
+def describe(config: EngineConfig) -> str:
+    parts = [config.engine, f"power={config.power}"]
+    if config.max_time is not None:
+        parts.append(f"max={config.max_time:g}")
+    if config.personality:
+        parts.append(f"personality={config.personality}")
+    parts.extend(f"{key}={value}" for key, value in sorted(config.options.items()))
+    return ",".join(parts)
+
+
+def parse_engine_spec(spec: str) -> EngineConfig:
+    """Parse ``power=3,max=1.5,personality=Défensif,engine=minimax``."""
+    config = EngineConfig()
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        key, _, value = item.partition("=")
+        if key == "power":
+            config.power = int(value)
+        elif key in ("max", "max_time"):
+            config.max_time = float(value) if value else None
+        elif key == "personality":
+            config.personality = value or None
+        elif key == "engine":
+            if value not in ENGINES:
+                raise ValueError(f"Unknown engine: {value}")
+            config.engine = value
+        else:
+            config.options[key] = _parse_value(value)
+    return config
+
+
+def _parse_value(value: str) -> object:
+    for cast in (int, float):
+        try:
+            return cast(value)
+        except ValueError:
+            pass
+    if value.lower() in ("true", "false"):
+        return value.lower() == "true"
+    return value
+
+
+# Players of this process, reused from one game to the next
+_players: Dict[Tuple[int, str], Tuple[Optional[int], AIPlayer]] = {}
+
+
+def _model_path(config: EngineConfig) -> Optional[str]:
+    # ``model=path.zip`` picks the DQN of the rl engine
+    return config.options.get("model", MODEL_PATH) if config.engine == "rl" else None
+
+
+def _make_player(config: EngineConfig, side: int):
+    model_path = _model_path(config)
+    # A model file replaced on disk gives a new player
+    version = os.stat(model_path).st_mtime_ns if model_path and os.path.exists(model_path) else None
+    key = (side, describe(config))
+    cached = _players.get(key)
+    if cached is not None and cached[0] == version:
+        ai = cached[1]
+        ai.new_game(config.personality)
+        return ai
+    options = {k: v for k, v in config.options.items() if k != "model"}
+    ai = AIPlayer(model_path, personality=config.personality, verbose=False, **options)
+    _players[key] = (version, ai)
+    return ai
+
+
+def ensure_models(*configs: EngineConfig) -> None:
+    """Train the missing DQN models once, before worker processes need them."""
+    for config in configs:
+        model_path = _model_path(config)
+        if model_path and not os.path.exists(model_path):
+            train(model_path, 1000)
+
+
+def _choose(ai, config: EngineConfig, board: Board, player: int, history: PositionHistory):
+    return ai.select_move(
+        config.engine, board, player, power=config.power, max_time=config.max_time, history=history.hashes
+    )
+
+
+def play_game(
+    configs: Tuple[EngineConfig, EngineConfig],
+    adjudication: Adjudication,
+    opening_plies: int = 0,
+    seed: Optional[int] = None,
+) -> Tuple[Optional[int], List[Move], str]:
+    """Play one game, ``configs[p]`` moving for player ``p``.
+
+    Returns the winner (``None`` for a draw), the moves played and the
+    reason the game ended.
+    """
+    rng = random.Random(seed)
+    if seed is not None:
+        random.seed(seed)
+    players = [_make_player(config, side) for side, config in enumerate(configs)]
+    board = Board()
+    current = 0
+    history = PositionHistory(board, current, adjudication)
+    moves: List[Move] = []
+    for ply in range(adjudication.max_plies):
+        if ply < opening_plies:
+            legal = legal_moves(board, current)
+            move = rng.choice(legal) if legal else None
+        else:
+            move = _choose(players[current], configs[current], board, current, history)
+        if move is None:
+            return 1 - current, moves, "no_moves"
+        target = board.get_piece(move[2], move[3])
+        history.push(board, move)
+        board.move_piece(move)
+        moves.append(move)
+        if target is not None and target.type.value == "C":
+            return current, moves, "castle"
+        draw = history.draw_reason()
+        if draw is not None:
+            return None, moves, draw
+        current = 1 - current
+    return None, moves, "max_plies"
+
+
+def _run_game(job: Tuple[int, EngineConfig, EngineConfig, Adjudication, int, int]) -> dict:
+    index, config_a, config_b, adjudication, opening_plies, seed = job
+    # Games come in pairs sharing an opening, with colours swapped
+    a_player = index % 2
+    configs = (config_a, config_b) if a_player == 0 else (config_b, config_a)
+    start = time.time()
+    winner, moves, reason = play_game(configs, adjudication, opening_plies, seed)
+    if winner is None:
+        score = 0.5
+    else:
+        score = 1.0 if winner == a_player else 0.0
+    return {
+        "game": index,
+        "a_player": a_player,
+        "score": score,
+        "plies": len(moves),
+        "reason": reason,
+        "seconds": round(time.time() - start, 3),
+        "winner": winner,
+        "moves": moves,
+    }
+
+
+def elo_from_score(score: float) -> float:
+    score = min(max(score, 1e-6), 1 - 1e-6)
+    return -400.0 * math.log10(1.0 / score - 1.0)
+
+
+def score_from_elo(elo: float) -> float:
+    return 1.0 / (1.0 + 10.0 ** (-elo / 400.0))
+
+
+class Stats:
+    def __init__(self) -> None:
+        self.wins = 0
+        self.draws = 0
+        self.losses = 0
+
+    def add(self, score: float) -> None:
+        if score == 1.0:
+            self.wins += 1
+        elif score == 0.0:
+            self.losses += 1
+        else:
+            self.draws += 1
+
+    @property
+    def games(self) -> int:
+        return self.wins + self.draws + self.losses
+
+    def _mean_var(self) -> Tuple[float, float]:
+        n = self.games
+        mean = (self.wins + 0.5 * self.draws) / n
+        var = (
+            self.wins * (1 - mean) ** 2
+            + self.draws * (0.5 - mean) ** 2
+            + self.losses * mean ** 2
+        ) / n
+        return mean, var
+
+    def elo(self, z: float = 1.96) -> Tuple[float, float, float]:
+        """Elo difference of A over B with its confidence interval."""
+        if not self.games:
+            return 0.0, -math.inf, math.inf
+        mean, var = self._mean_var()
+        margin = z * math.sqrt(var / self.games)
+        return (
+            elo_from_score(mean),
+            elo_from_score(mean - margin),
+            elo_from_score(mean + margin),
+        )
+
+    def llr(self, elo0: float, elo1: float) -> float:
+        """Log-likelihood ratio of H1 (elo1) against H0 (elo0)."""
+        if not self.games:
+            return 0.0
+        mean, var = self._mean_var()
+        if var == 0:
+            return 0.0
+        s0 = score_from_elo(elo0)
+        s1 = score_from_elo(elo1)
+        return self.games * (s1 - s0) * (2 * mean - s0 - s1) / (2 * var)
+
+
+def sprt_bounds(alpha: float, beta: float) -> Tuple[float, float]:
+    return math.log(beta / (1 - alpha)), math.log((1 - beta) / alpha)
+
+
+def run_arena(
+    config_a: EngineConfig,
+    config_b: EngineConfig,
+    games: int,
+    out_path: Optional[str] = None,
+    workers: Optional[int] = None,
+    adjudication: Optional[Adjudication] = None,
+    opening_plies: int = 4,
+    seed: int = 0,
+    sprt: Optional[Tuple[float, float, float, float]] = None,
+    record_path: Optional[str] = None,
+) -> Stats:
+    """Play ``games`` games of A against B on a process pool.
+
+    ``sprt`` is ``(elo0, elo1, alpha, beta)``; when given the match stops as
+    soon as the log-likelihood ratio crosses one of its bounds.
+    """
+    adjudication = adjudication or Adjudication()
+    workers = workers or os.cpu_count() or 1
+    ensure_models(config_a, config_b)
+    jobs: Iterator = (
+        (i, config_a, config_b, adjudication, opening_plies, seed + i // 2)
+        for i in range(games)
+    )
+    bounds = sprt_bounds(sprt[2], sprt[3]) if sprt else None
+    stats = Stats()
+    names = (describe(config_a), describe(config_b))
+    powers = (config_a.power, config_b.power)
+    out = open(out_path, "a", encoding="utf-8") if out_path else None
+    recorder = RecordWriter(record_path) if record_path else None
+    start = time.time()
+    try:
+        with multiprocessing.Pool(workers) as pool:
+            for result in pool.imap_unordered(_run_game, jobs, chunksize=4):
+                stats.add(result["score"])
+                moves = result.pop("moves")
+                winner = result.pop("winner")
+                if recorder:
+                    order = (0, 1) if result["a_player"] == 0 else (1, 0)
+                    recorder.write(GameRecord(
+                        players=(names[order[0]], names[order[1]]),
+                        powers=(powers[order[0]], powers[order[1]]),
+                        result=DRAW if winner is None else winner,
+                        reason=result["reason"],
+                        moves=moves,
+                    ))
+                if out:
+                    out.write(json.dumps(result) + "\n")
+                    out.flush()
+                elo, low, high = stats.elo()
+                rate = stats.games / max(time.time() - start, 1e-9) * 60
+                line = (
+                    f"{stats.games}/{games} +{stats.wins} ={stats.draws} -{stats.losses} "
+                    f"Elo {elo:+.1f} [{low:+.1f}, {high:+.1f}] {rate:.1f} parties/min"
+                )
+                if bounds:
+                    llr = stats.llr(sprt[0], sprt[1])
+                    line += f" LLR {llr:.2f} [{bounds[0]:.2f}, {bounds[1]:.2f}]"
+                    if llr <= bounds[0] or llr >= bounds[1]:
+                        print(line)
+                        print("SPRT: H1 acceptée" if llr >= bounds[1] else "SPRT: H0 acceptée")
+                        pool.terminate()
+                        break
+                print(line, flush=True)
+    finally:
+        if out:
+            out.close()
+        if recorder:
+            recorder.close()
+    return stats
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Fait s'affronter deux bots MedChess")
+    parser.add_argument("-a", default="", help="Moteur A, ex. power=3,max=1,personality=Défensif")
+    parser.add_argument("-b", default="", help="Moteur B, même format que -a")
+    parser.add_argument("-games", type=int, default=1000, help="Nombre de parties")
+    parser.add_argument("-workers", type=int, default=None, help="Nombre de processus (tous les coeurs par défaut)")
+    parser.add_argument("-out", default=None, help="Fichier JSON lines recevant le résultat de chaque partie")
+    parser.add_argument("-record", default=None, help="Fichier où enregistrer les parties jouées")
+    parser.add_argument("-opening", type=int, default=4, help="Coups aléatoires joués en début de partie")
+    parser.add_argument("-seed", type=int, default=0, help="Graine des ouvertures aléatoires")
+    parser.add_argument("-repetitions", type=int, default=3, help="Nulle après N répétitions d'une position")
+    parser.add_argument("-no-progress", type=int, default=50, help="Nulle après N demi-coups sans capture")
+    parser.add_argument("-max-plies", type=int, default=400, help="Nulle après N demi-coups")
+    parser.add_argument("-sprt", type=float, nargs=2, metavar=("ELO0", "ELO1"), help="Arrêt SPRT entre ELO0 et ELO1")
+    parser.add_argument("-alpha", type=float, default=0.05)
+    parser.add_argument("-beta", type=float, default=0.05)
+    args = parser.parse_args(argv)
+
+    adjudication = Adjudication(args.repetitions, args.no_progress, args.max_plies)
+    sprt = (args.sprt[0], args.sprt[1], args.alpha, args.beta) if args.sprt else None
+    run_arena(
+        parse_engine_spec(args.a),
+        parse_engine_spec(args.b),
+        args.games,
+        out_path=args.out,
+        workers=args.workers,
+        adjudication=adjudication,
+        opening_plies=args.opening,
+        seed=args.seed,
+        sprt=sprt,
+        record_path=args.record,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,80 +1,81 @@
 from __future__ import annotations
 
-from dataclasses import dataclass
-from typing import List, Optional, Tuple
+from typing import Optional, Tuple
 
-from .pieces import Piece, PieceType
+from .pieces import PIECES, Piece, PieceType, piece_code
 
 BOARD_WIDTH = 7
 BOARD_HEIGHT = 6
+SQUARES = BOARD_WIDTH * BOARD_HEIGHT
 
 Move = Tuple[int, int, int, int]  # from_row, from_col, to_row, to_col
 
-@dataclass
-class Cell:
-    piece: Optional[Piece] = None
+def _initial_cells() -> bytes:
+    first_row = [
+        PieceType.KNIGHT,
+        PieceType.KNIGHT,
+        PieceType.GENERAL,
+        PieceType.CASTLE,
+        PieceType.GENERAL,
+        PieceType.KNIGHT,
+        PieceType.KNIGHT,
+    ]
+    cells = bytearray(SQUARES)
+    for c, t in enumerate(first_row):
+        # IA pieces (player 1) occupy the top of the board
+        cells[c] = piece_code(Piece(t, 1))
+        # Player pieces (player 0) occupy the bottom
+        cells[(BOARD_HEIGHT - 1) * BOARD_WIDTH + c] = piece_code(Piece(t, 0))
+    for c in range(BOARD_WIDTH):
+        cells[BOARD_WIDTH + c] = piece_code(Piece(PieceType.SWORDSMAN, 1))
+        cells[(BOARD_HEIGHT - 2) * BOARD_WIDTH + c] = piece_code(Piece(PieceType.SWORDSMAN, 0))
+    return bytes(cells)
+
+INITIAL_CELLS = _initial_cells()
 
 class Board:
+    # Squares are stored row by row in one buffer, using the piece codes
+    # from pieces.PIECE_CODES, so copies and observations are buffer copies
+    __slots__ = ("cells",)
+
     def __init__(self) -> None:
-        self.grid: List[List[Cell]] = [
-            [Cell() for _ in range(BOARD_WIDTH)] for _ in range(BOARD_HEIGHT)
-        ]
-        self.reset()
+        self.cells = bytearray(INITIAL_CELLS)
 
     def reset(self) -> None:
-        # Clear board
-        for row in self.grid:
-            for cell in row:
-                cell.piece = None
-        # Setup initial pieces
-        first_row = [
-            PieceType.KNIGHT,
-            PieceType.KNIGHT,
-            PieceType.GENERAL,
-            PieceType.CASTLE,
-            PieceType.GENERAL,
-            PieceType.KNIGHT,
-            PieceType.KNIGHT,
-        ]
-        for c, t in enumerate(first_row):
-            # IA pieces (player 1) occupy the top of the board
-            self.grid[0][c].piece = Piece(t, 1)
-            # Player pieces (player 0) occupy the bottom
-            self.grid[BOARD_HEIGHT - 1][c].piece = Piece(t, 0)
-
-        for c in range(BOARD_WIDTH):
-            self.grid[1][c].piece = Piece(PieceType.SWORDSMAN, 1)
-            self.grid[BOARD_HEIGHT - 2][c].piece = Piece(PieceType.SWORDSMAN, 0)
+        self.cells[:] = INITIAL_CELLS
 
     def in_bounds(self, r: int, c: int) -> bool:
         return 0 <= r < BOARD_HEIGHT and 0 <= c < BOARD_WIDTH
 
+    def get_code(self, r: int, c: int) -> int:
+        return self.cells[r * BOARD_WIDTH + c] if self.in_bounds(r, c) else 0
+
     def get_piece(self, r: int, c: int) -> Optional[Piece]:
-        return self.grid[r][c].piece if self.in_bounds(r, c) else None
+        return PIECES[self.cells[r * BOARD_WIDTH + c]] if self.in_bounds(r, c) else None
+
+    def set_piece(self, r: int, c: int, piece: Optional[Piece]) -> None:
+        self.cells[r * BOARD_WIDTH + c] = piece_code(piece) if piece else 0
 
     def move_piece(self, move: Move) -> bool:
         fr, fc, tr, tc = move
         if not (self.in_bounds(fr, fc) and self.in_bounds(tr, tc)):
             return False
-        piece = self.get_piece(fr, fc)
-        if not piece:
+        cells = self.cells
+        src = fr * BOARD_WIDTH + fc
+        dst = tr * BOARD_WIDTH + tc
+        code = cells[src]
+        if not code:
             return False
-        target = self.get_piece(tr, tc)
-        if target and target.player == piece.player:
+        target = cells[dst]
+        if target and (target > 4) == (code > 4):
             return False
-        self.grid[tr][tc].piece = piece
-        self.grid[fr][fc].piece = None
+        cells[dst] = code
+        cells[src] = 0
         return True
 
     def copy(self) -> "Board":
-        b = Board()
-        for r in range(BOARD_HEIGHT):
-            for c in range(BOARD_WIDTH):
-                piece = self.get_piece(r, c)
-                if piece:
-                    b.grid[r][c].piece = Piece(piece.type, piece.player)
-                else:
-                    b.grid[r][c].piece = None
+        b = Board.__new__(Board)
+        b.cells = self.cells[:]
         return b
 
     def render(self) -> str:
@@ -0,0 +1,102 @@
+# Piece-square evaluation, for single boards and batches of observations
+#
+# The parameters are one table per piece type giving the value of that piece
+# on each square, seen from player 0 (who starts at the bottom). Player 1
+# uses the same tables mirrored vertically. The default tables reproduce the
+# hand-written values: 1, 1, 2.5 and 1000 points plus 0.1 point per row
+# advanced from the starting row.
+import json
+import os
+from typing import Dict, Optional
+
+import numpy as np
+
+from .board import Board, BOARD_HEIGHT, BOARD_WIDTH, SQUARES
+from .pieces import CASTLE_CODES, PIECE_CODES, PieceType
+
+WEIGHTS_PATH = os.path.join(os.path.dirname(__file__), "weights.json")
+PIECE_VALUES = {
+    PieceType.SWORDSMAN: 1.0,
+    PieceType.KNIGHT: 1.0,
+    PieceType.GENERAL: 2.5,
+    PieceType.CASTLE: 1000.0,
+}
+ADVANCE_BONUS = 0.1
+# Returned when a castle has been captured
+WIN_SCORE = 1000.0
+# Piece types in code order, the tables array is indexed by code - 1
+PIECE_ORDER = sorted(PIECE_CODES, key=PIECE_CODES.get)
+# Square seen from the other side of the board
+MIRROR = np.array(
+    [(BOARD_HEIGHT - 1 - sq // BOARD_WIDTH) * BOARD_WIDTH + sq % BOARD_WIDTH for sq in range(SQUARES)]
+)
+
+
+def default_tables() -> np.ndarray:
+    tables = np.zeros((len(PIECE_ORDER), BOARD_HEIGHT, BOARD_WIDTH), dtype=np.float64)
+    for i, ptype in enumerate(PIECE_ORDER):
+        tables[i] = PIECE_VALUES[ptype]
+        if ptype == PieceType.CASTLE:
+            continue
+        start_row = BOARD_HEIGHT - 2 if ptype == PieceType.SWORDSMAN else BOARD_HEIGHT - 1
+        for r in range(BOARD_HEIGHT):
+            tables[i, r] += (start_row - r) * ADVANCE_BONUS
+    return tables
+
+
+class Evaluator:
+    def __init__(self, tables: Optional[np.ndarray] = None) -> None:
+        self.tables = default_tables() if tables is None else np.asarray(tables, dtype=np.float64)
+        flat = self.tables.reshape(len(PIECE_ORDER), SQUARES)
+        # Score of each square code on each square, from player 0's side
+        self.lookup = np.zeros((9, SQUARES), dtype=np.float64)
+        self.lookup[1:5] = flat
+        self.lookup[5:9] = -flat[:, MIRROR]
+        # Flat copy indexed by code * SQUARES + square for the scalar path
+        self._flat = self.lookup.ravel().tolist()
+
+    @classmethod
+    def load(cls, path: str = WEIGHTS_PATH) -> "Evaluator":
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        tables = np.array([data[ptype.name] for ptype in PIECE_ORDER], dtype=np.float64)
+        return cls(tables)
+
+    def save(self, path: str = WEIGHTS_PATH) -> None:
+        data: Dict[str, list] = {
+            ptype.name: np.round(self.tables[i], 4).tolist() for i, ptype in enumerate(PIECE_ORDER)
+        }
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=1)
+        os.replace(tmp_path, path)
+
+    def evaluate(self, board: Board, player: int) -> float:
+        cells = board.cells
+        if CASTLE_CODES[player] not in cells:
+            return -WIN_SCORE
+        if CASTLE_CODES[1 - player] not in cells:
+            return WIN_SCORE
+        flat = self._flat
+        score = 0.0
+        for square, code in enumerate(cells):
+            if code:
+                score += flat[code * SQUARES + square]
+        return score if player == 0 else -score
+
+    def evaluate_batch(self, obs: np.ndarray) -> np.ndarray:
+        """Scores from player 0's side of an ``(N, 6, 7)`` batch of observations."""
+        codes = np.asarray(obs).reshape(-1, SQUARES).astype(np.intp)
+        scores = self.lookup[codes, np.arange(SQUARES)].sum(axis=1)
+        missing0 = ~(codes == CASTLE_CODES[0]).any(axis=1)
+        missing1 = ~(codes == CASTLE_CODES[1]).any(axis=1)
+        scores[missing1] = WIN_SCORE
+        scores[missing0] = -WIN_SCORE
+        return scores
+
+
+def load_default() -> Evaluator:
+    # Tuned weights when a weights file has been written, else the defaults
+    if os.path.exists(WEIGHTS_PATH):
+        return Evaluator.load(WEIGHTS_PATH)
+    return Evaluator()
@@ -3,10 +3,15 @@ import signal
 from typing import Optional
 
 from .board import Board
-from .rules import legal_moves
-from .ai import AIPlayer
+from .rules import DrawRule, PositionHistory, is_legal
+from .ai import AIPlayer, ENGINES
+from .record import DRAW, GameRecord, save_record
 
 TIME_LIMIT = 30
+DRAW_MESSAGES = {
+    'repetition': 'Position répétée : partie nulle.',
+    'no_progress': 'Trop de coups sans capture : partie nulle.',
+}
 
 class TimeoutException(Exception):
     pass
@@ -29,10 +34,18 @@ def parse_move(text: str) -> Optional[tuple[int, int, int, int]]:
     except Exception:
         return None
 
-def play(power: int = 1, max_time: int = TIME_LIMIT) -> None:
+def play(
+    power: int = 1,
+    max_time: int = TIME_LIMIT,
+    record_path: Optional[str] = None,
+    draw_rule: Optional[DrawRule] = None,
+    engine: str = 'minimax',
+) -> None:
     board = Board()
     ai = AIPlayer(os.path.join(os.path.dirname(__file__), 'model.zip'))
+    record = GameRecord(players=('Humain', f'Bot {ai.personality}'), powers=(0, power))
     current_player = 0
+    history = PositionHistory(board, current_player, draw_rule)
     while True:
         print(board.render())
         if current_player == 0:
@@ -40,29 +53,48 @@ def play(power: int = 1, max_time: int = TIME_LIMIT) -> None:
                 user_move = timed_input('Votre coup (fr fc tr tc): ', max_time)
             except TimeoutException:
                 print('Temps écoulé ! Vous avez perdu.')
+                save_record(record_path, record, 1, 'timeout')
                 return
             move = parse_move(user_move)
-            if move is None or move not in legal_moves(board, current_player):
+            if move is None or not is_legal(board, move, current_player):
                 print('Coup invalide, vous avez perdu.')
+                save_record(record_path, record, 1, 'illegal')
                 return
             fr, fc, tr, tc = move
             target = board.get_piece(tr, tc)
+            history.push(board, move)
             board.move_piece(move)
+            record.moves.append(move)
             if target and target.type.value == 'C':
                 print('Vous avez capturé le chateau adverse. Vous gagnez !')
+                save_record(record_path, record, 0, 'castle')
                 return
         else:
-            move = ai.choose_move(board, current_player, power=power, max_time=max_time)
+            move = ai.select_move(
+                engine, board, current_player, power=power, max_time=max_time, history=history.hashes
+            )
             if move is None:
                 print('Le bot ne peut jouer. Vous gagnez !')
+                save_record(record_path, record, 0, 'no_moves')
                 return
             fr, fc, tr, tc = move
             print(f'Bot joue: {fr} {fc} {tr} {tc}')
+            if engine == 'mcts':
+                print(f'{ai.mcts.playouts} simulations ({ai.mcts.playouts_per_second:.0f}/s)')
             target = board.get_piece(tr, tc)
+            history.push(board, move)
             board.move_piece(move)
+            record.moves.append(move)
             if target and target.type.value == 'C':
                 print('Le bot capture votre chateau. Vous perdez !')
+                save_record(record_path, record, 1, 'castle')
                 return
+        draw = history.draw_reason()
+        if draw is not None:
+            print(board.render())
+            print(DRAW_MESSAGES[draw])
+            save_record(record_path, record, DRAW, draw)
+            return
         current_player = 1 - current_player
 
 if __name__ == "__main__":
@@ -71,6 +103,16 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Play MedChess in the terminal")
     parser.add_argument("-power", type=int, default=1, help="Profondeur de recherche de l'IA (1-10)")
     parser.add_argument("-max", type=int, default=TIME_LIMIT, help="Temps de réflexion maximum en secondes")
+    parser.add_argument("-record", default=None, help="Fichier où enregistrer la partie")
+    parser.add_argument("-engine", choices=ENGINES, default="minimax", help="Moteur de l'IA")
+    parser.add_argument("-repetitions", type=int, default=3, help="Nulle après N répétitions d'une position (0 pour désactiver)")
+    parser.add_argument("-no-progress", type=int, default=50, help="Nulle après N demi-coups sans capture (0 pour désactiver)")
     args = parser.parse_args()
 
-    play(power=args.power, max_time=args.max)
+    play(
+        power=args.power,
+        max_time=args.max,
+        record_path=args.record,
+        draw_rule=DrawRule(args.repetitions, args.no_progress),
+        engine=args.engine,
+    )
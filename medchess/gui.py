@@ -6,18 +6,35 @@ import threading
 import time
 import tkinter as tk
 from tkinter import messagebox
-from PIL import Image, ImageTk
+from PIL import ImageTk
 
 from .board import Board, BOARD_WIDTH, BOARD_HEIGHT
-from .pieces import PieceType
-from .rules import legal_moves
-from .ai import AIPlayer
+from .rules import DrawRule, PositionHistory, is_legal
+from .ai import AIPlayer, ENGINES
 from . import network
+from . import sprites
+from .record import DRAW, GameRecord, UNKNOWN, save_record
+from .game import DRAW_MESSAGES
 
 CELL_SIZE = 60
 
+
+def load_piece_images(cell_size: int) -> dict:
+    return {
+        key: ImageTk.PhotoImage(img)
+        for key, img in sprites.load_sprites(cell_size).items()
+    }
+
+
 class GameGUI(tk.Tk):
-    def __init__(self, power: int = 1, max_time: int = 30) -> None:
+    def __init__(
+        self,
+        power: int = 1,
+        max_time: int = 30,
+        record_path: str | None = None,
+        draw_rule: DrawRule | None = None,
+        engine: str = "minimax",
+    ) -> None:
         super().__init__()
         self.title("MedChess")
         self.resizable(False, False)
@@ -27,7 +44,11 @@ class GameGUI(tk.Tk):
         self.ai = AIPlayer(model_path)
         self.power = power
         self.max_time = max_time
+        self.engine = engine
         self.current_player = 0
+        self.record_path = record_path
+        self.record = GameRecord(players=("Humain", f"Bot {self.ai.personality}"), powers=(0, power))
+        self.history = PositionHistory(self.board, self.current_player, draw_rule)
         self.selected = None
         self.images = {}
         self.load_images()
@@ -39,28 +60,27 @@ class GameGUI(tk.Tk):
         self.canvas.bind("<Button-1>", self.on_click)
 
         self.draw_board()
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+
+    def end_game(self, result: int, reason: str) -> None:
+        save_record(self.record_path, self.record, result, reason)
+        self.record_path = None
+        self.destroy()
+
+    def on_close(self) -> None:
+        self.end_game(UNKNOWN, "abandoned")
+
+    def check_draw(self) -> bool:
+        draw = self.history.draw_reason()
+        if draw is None:
+            return False
+        self.draw_board()
+        messagebox.showinfo("Partie nulle", DRAW_MESSAGES[draw])
+        self.end_game(DRAW, draw)
+        return True
 
     def load_images(self) -> None:
-        img_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "images")
-        mapping = {
-            PieceType.SWORDSMAN: "epeiste.png",
-            PieceType.KNIGHT: "chevalier.png",
-            PieceType.GENERAL: "general.png",
-            PieceType.CASTLE: "chateau.png",
-        }
-        for ptype, filename in mapping.items():
-            path = os.path.join(img_dir, filename)
-            base = (
-                Image.open(path)
-                .resize((CELL_SIZE, CELL_SIZE), Image.LANCZOS)
-                .convert("RGBA")
-            )
-            blue_overlay = Image.new("RGBA", base.size, (0, 0, 255, 80))
-            red_overlay = Image.new("RGBA", base.size, (255, 0, 0, 80))
-            blue_img = Image.alpha_composite(base, blue_overlay)
-            red_img = Image.alpha_composite(base, red_overlay)
-            self.images[(ptype, 0)] = ImageTk.PhotoImage(blue_img)
-            self.images[(ptype, 1)] = ImageTk.PhotoImage(red_img)
+        self.images = load_piece_images(CELL_SIZE)
 
     def draw_board(self) -> None:
         self.canvas.delete("all")
@@ -124,14 +144,18 @@ class GameGUI(tk.Tk):
             else:
                 fr, fc = self.selected
                 move = (fr, fc, r, c)
-                if move in legal_moves(self.board, 0):
+                if is_legal(self.board, move, 0):
                     target = self.board.get_piece(r, c)
                     self.animate_move(move)
+                    self.history.push(self.board, move)
                     self.board.move_piece(move)
+                    self.record.moves.append(move)
                     self.selected = None
                     if target and target.type.value == 'C':
                         messagebox.showinfo("Victoire", "Vous avez capturé le chateau adverse.")
-                        self.destroy()
+                        self.end_game(0, "castle")
+                        return
+                    if self.check_draw():
                         return
                     self.current_player = 1
                     self.draw_board()
@@ -142,29 +166,49 @@ class GameGUI(tk.Tk):
         self.draw_board()
 
     def ai_move(self) -> None:
-        move = self.ai.choose_move(self.board, 1, power=self.power, max_time=self.max_time)
+        move = self.ai.select_move(
+            self.engine, self.board, 1, power=self.power, max_time=self.max_time, history=self.history.hashes
+        )
+        if self.engine == "mcts":
+            self.title(f"MedChess - {self.ai.mcts.playouts_per_second:.0f} simulations/s")
         if move is None:
             messagebox.showinfo("Victoire", "Le bot ne peut jouer. Vous gagnez !")
-            self.destroy()
+            self.end_game(0, "no_moves")
             return
         fr, fc, tr, tc = move
         target = self.board.get_piece(tr, tc)
         self.animate_move(move)
+        self.history.push(self.board, move)
         self.board.move_piece(move)
+        self.record.moves.append(move)
         if target and target.type.value == 'C':
             messagebox.showinfo("Défaite", "Le bot capture votre chateau.")
-            self.destroy()
+            self.end_game(1, "castle")
+            return
+        if self.check_draw():
             return
         self.current_player = 0
         self.draw_board()
 
 
-def play_gui(power: int = 1, max_time: int = 30) -> None:
-    app = GameGUI(power=power, max_time=max_time)
+def play_gui(
+    power: int = 1,
+    max_time: int = 30,
+    record_path: str | None = None,
+    draw_rule: DrawRule | None = None,
+    engine: str = "minimax",
+) -> None:
+    app = GameGUI(power=power, max_time=max_time, record_path=record_path, draw_rule=draw_rule, engine=engine)
     app.mainloop()
 
 class NetworkGameGUI(tk.Tk):
-    def __init__(self, sock: socket.socket, host: bool) -> None:
+    def __init__(
+        self,
+        sock: socket.socket,
+        host: bool,
+        record_path: str | None = None,
+        draw_rule: DrawRule | None = None,
+    ) -> None:
         super().__init__()
         self.title("MedChess - Multijoueur")
         self.resizable(False, False)
@@ -173,6 +217,9 @@ class NetworkGameGUI(tk.Tk):
         self.sock = sock
         self.player_id = 0 if host else 1
         self.current_player = 0
+        self.record_path = record_path
+        self.record = GameRecord(players=("Hôte", "Invité"))
+        self.history = PositionHistory(self.board, self.current_player, draw_rule)
         self.selected = None
         self.images = {}
         self.load_images()
@@ -193,26 +240,7 @@ class NetworkGameGUI(tk.Tk):
         self.protocol("WM_DELETE_WINDOW", self.on_close)
 
     def load_images(self) -> None:
-        img_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "images")
-        mapping = {
-            PieceType.SWORDSMAN: "epeiste.png",
-            PieceType.KNIGHT: "chevalier.png",
-            PieceType.GENERAL: "general.png",
-            PieceType.CASTLE: "chateau.png",
-        }
-        for ptype, filename in mapping.items():
-            path = os.path.join(img_dir, filename)
-            base = (
-                Image.open(path)
-                .resize((CELL_SIZE, CELL_SIZE), Image.LANCZOS)
-                .convert("RGBA")
-            )
-            blue_overlay = Image.new("RGBA", base.size, (0, 0, 255, 80))
-            red_overlay = Image.new("RGBA", base.size, (255, 0, 0, 80))
-            blue_img = Image.alpha_composite(base, blue_overlay)
-            red_img = Image.alpha_composite(base, red_overlay)
-            self.images[(ptype, 0)] = ImageTk.PhotoImage(blue_img)
-            self.images[(ptype, 1)] = ImageTk.PhotoImage(red_img)
+        self.images = load_piece_images(CELL_SIZE)
 
     def draw_board(self) -> None:
         self.canvas.delete("all")
@@ -263,7 +291,23 @@ class NetworkGameGUI(tk.Tk):
             time.sleep(0.03)
         self.canvas.delete(item)
 
+    def end_game(self, result: int, reason: str) -> None:
+        save_record(self.record_path, self.record, result, reason)
+        self.record_path = None
+        self.on_close()
+
+    def check_draw(self) -> bool:
+        draw = self.history.draw_reason()
+        if draw is None:
+            return False
+        self.draw_board()
+        messagebox.showinfo("Partie nulle", DRAW_MESSAGES[draw])
+        self.end_game(DRAW, draw)
+        return True
+
     def on_close(self) -> None:
+        save_record(self.record_path, self.record, UNKNOWN, "abandoned")
+        self.record_path = None
         self.running = False
         try:
             self.sock.close()
@@ -298,12 +342,20 @@ class NetworkGameGUI(tk.Tk):
             except queue.Empty:
                 self.after(100, self._check_incoming)
                 return
+            if not is_legal(self.board, move, self.current_player):
+                messagebox.showerror("Erreur", "Coup adverse invalide.")
+                self.end_game(self.player_id, "illegal")
+                return
             target = self.board.get_piece(move[2], move[3])
             self.animate_move(move)
+            self.history.push(self.board, move)
             self.board.move_piece(move)
+            self.record.moves.append(move)
             if target and target.type.value == "C":
                 messagebox.showinfo("Defaite", "Votre chateau a été capturé.")
-                self.on_close()
+                self.end_game(1 - self.player_id, "castle")
+                return
+            if self.check_draw():
                 return
             self.current_player = self.player_id
             self.draw_board()
@@ -323,15 +375,19 @@ class NetworkGameGUI(tk.Tk):
         else:
             fr, fc = self.selected
             move = (fr, fc, r, c)
-            if move in legal_moves(self.board, self.player_id):
+            if is_legal(self.board, move, self.player_id):
                 target = self.board.get_piece(r, c)
                 self.animate_move(move)
+                self.history.push(self.board, move)
                 self.board.move_piece(move)
                 network.send_move(self.sock, move)
+                self.record.moves.append(move)
                 self.selected = None
                 if target and target.type.value == "C":
                     messagebox.showinfo("Victoire", "Vous avez capturé le chateau adverse.")
-                    self.on_close()
+                    self.end_game(self.player_id, "castle")
+                    return
+                if self.check_draw():
                     return
                 self.current_player = 1 - self.player_id
                 self.draw_board()
@@ -402,12 +458,12 @@ def multiplayer_setup() -> tuple[socket.socket, bool] | None:
         return None
     return result["sock"], bool(result["host"])
 
-def play_multiplayer() -> None:
+def play_multiplayer(record_path: str | None = None, draw_rule: DrawRule | None = None) -> None:
     setup = multiplayer_setup()
     if not setup:
         return
     sock, host = setup
-    app = NetworkGameGUI(sock, host)
+    app = NetworkGameGUI(sock, host, record_path=record_path, draw_rule=draw_rule)
     app.mainloop()
 
 
@@ -418,10 +474,21 @@ if __name__ == "__main__":
     parser.add_argument("-power", type=int, default=1, help="Profondeur de recherche de l'IA (1-10)")
     parser.add_argument("-max", type=int, default=30, help="Temps de réflexion maximum en secondes")
     parser.add_argument("-multiplayer", action="store_true", help="Lancer en mode multijoueur")
+    parser.add_argument("-engine", choices=ENGINES, default="minimax", help="Moteur de l'IA")
+    parser.add_argument("-record", default=None, help="Fichier où enregistrer la partie")
+    parser.add_argument("-repetitions", type=int, default=3, help="Nulle après N répétitions d'une position (0 pour désactiver)")
+    parser.add_argument("-no-progress", type=int, default=50, help="Nulle après N demi-coups sans capture (0 pour désactiver)")
     args = parser.parse_args()
 
+    draw_rule = DrawRule(args.repetitions, args.no_progress)
     if args.multiplayer:
-        play_multiplayer()
+        play_multiplayer(record_path=args.record, draw_rule=draw_rule)
     else:
-        play_gui(power=args.power, max_time=args.max)
+        play_gui(
+            power=args.power,
+            max_time=args.max,
+            record_path=args.record,
+            draw_rule=draw_rule,
+            engine=args.engine,
+        )
 
@@ -0,0 +1,347 @@
+# Monte Carlo tree search guided by a policy/value network
+#
+# Leaves are evaluated in batches: each round selects up to ``batch_size``
+# leaves, marking the paths with a virtual loss so that the selections
+# spread over the tree, then scores all of them with one forward pass.
+import argparse
+import math
+import os
+import time
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import torch
+from torch import nn
+
+from .board import Board, Move, BOARD_HEIGHT, BOARD_WIDTH, SQUARES
+from .evaluation import Evaluator
+from .pieces import CASTLE_CODES
+from .record import DRAW, encode_move, read_records, replay
+from .rules import legal_moves
+from .zobrist import position_hash, update_hash
+
+MODEL_PATH = os.path.join(os.path.dirname(__file__), "mcts.pt")
+ACTIONS = SQUARES * SQUARES
+# 8 piece planes and one plane for the player to move
+PLANES = 9
+
+
+def encode_planes(boards: Sequence[Board], players: Sequence[int]) -> np.ndarray:
+    cells = np.frombuffer(b"".join(b.cells for b in boards), dtype=np.uint8)
+    cells = cells.reshape(len(boards), BOARD_HEIGHT, BOARD_WIDTH)
+    planes = np.zeros((len(boards), PLANES, BOARD_HEIGHT, BOARD_WIDTH), dtype=np.float32)
+    for code in range(1, 9):
+        planes[:, code - 1] = cells == code
+    planes[:, 8] = np.asarray(players, dtype=np.float32)[:, None, None]
+    return planes
+
+
+class PolicyValueNet(nn.Module):
+    def __init__(self, channels: int = 64) -> None:
+        super().__init__()
+        self.body = nn.Sequential(
+            nn.Conv2d(PLANES, channels, 3, padding=1),
+            nn.ReLU(),
+            nn.Conv2d(channels, channels, 3, padding=1),
+            nn.ReLU(),
+            nn.Conv2d(channels, channels, 3, padding=1),
+            nn.ReLU(),
+        )
+        flat = channels * SQUARES
+        self.policy = nn.Linear(flat, ACTIONS)
+        self.value = nn.Sequential(nn.Linear(flat, 64), nn.ReLU(), nn.Linear(64, 1), nn.Tanh())
+
+    def forward(self, x: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        h = self.body(x).flatten(1)
+        return self.policy(h), self.value(h).squeeze(1)
+
+
+class NetworkEvaluator:
+    """Batched policy priors and values from a PolicyValueNet."""
+
+    def __init__(self, model: PolicyValueNet, device: str = "cpu") -> None:
+        self.model = model.to(device).eval()
+        self.device = device
+
+    @classmethod
+    def load(cls, path: str, device: str = "cpu") -> "NetworkEvaluator":
+        model = PolicyValueNet()
+        model.load_state_dict(torch.load(path, map_location=device))
+        return cls(model, device)
+
+    def evaluate(self, boards: Sequence[Board], players: Sequence[int]) -> Tuple[np.ndarray, np.ndarray]:
+        x = torch.from_numpy(encode_planes(boards, players)).to(self.device)
+        with torch.no_grad():
+            logits, values = self.model(x)
+        return logits.cpu().numpy(), values.cpu().numpy()
+
+
+class MaterialEvaluator:
+    """Uniform priors and the piece-square score as value, used when no network is trained."""
+
+    def __init__(self, evaluator: Optional[Evaluator] = None, scale: float = 4.0) -> None:
+        self.evaluator = evaluator or Evaluator()
+        self.scale = scale
+
+    def evaluate(self, boards: Sequence[Board], players: Sequence[int]) -> Tuple[np.ndarray, np.ndarray]:
+        cells = np.frombuffer(b"".join(b.cells for b in boards), dtype=np.uint8)
+        scores = self.evaluator.evaluate_batch(cells.reshape(len(boards), SQUARES))
+        sign = 1 - 2 * np.asarray(players, dtype=np.float64)
+        logits = np.zeros((len(boards), ACTIONS), dtype=np.float32)
+        return logits, np.tanh(scores * sign / self.scale)
+
+
+def load_examples(
+    record_paths: Iterable[str], max_positions: Optional[int] = None
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Planes, move played and result for the player to move of each recorded position."""
+    boards: List[Board] = []
+    players: List[int] = []
+    actions: List[int] = []
+    values: List[float] = []
+    for path in record_paths:
+        for record in read_records(path):
+            if record.result not in (0, 1, DRAW):
+                continue
+            for board, player, move in replay(record):
+                boards.append(board.copy())
+                players.append(player)
+                actions.append(encode_move(move))
+                values.append(0.0 if record.result == DRAW else (1.0 if record.result == player else -1.0))
+            if max_positions is not None and len(boards) >= max_positions:
+                break
+        if max_positions is not None and len(boards) >= max_positions:
+            break
+    if not boards:
+        raise ValueError("No finished game found in the records")
+    boards, players = boards[:max_positions], players[:max_positions]
+    return (
+        encode_planes(boards, players),
+        np.array(actions[:max_positions], dtype=np.int64),
+        np.array(values[:max_positions], dtype=np.float32),
+    )
+
+
+def train_network(
+    planes: np.ndarray,
+    actions: np.ndarray,
+    values: np.ndarray,
+    model: Optional[PolicyValueNet] = None,
+    epochs: int = 10,
+    batch_size: int = 256,
+    lr: float = 1e-3,
+    verbose: bool = True,
+) -> PolicyValueNet:
+    """Fit the policy to the moves played and the value to the game results."""
+    model = model or PolicyValueNet()
+    model.train()
+    optimizer = torch.optim.Adam(model.parameters(), lr=lr)
+    x = torch.from_numpy(planes)
+    target_actions = torch.from_numpy(actions)
+    target_values = torch.from_numpy(values)
+    for epoch in range(1, epochs + 1):
+        order = torch.randperm(len(x))
+        total = 0.0
+        for i in range(0, len(x), batch_size):
+            batch = order[i:i + batch_size]
+            logits, value = model(x[batch])
+            loss = nn.functional.cross_entropy(logits, target_actions[batch])
+            loss = loss + nn.functional.mse_loss(value, target_values[batch])
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            total += loss.item() * len(batch)
+        if verbose:
+            print(f"epoch {epoch} perte {total / len(x):.4f}")
+    return model.eval()
+
+
+class Node:
+    __slots__ = ("hash", "prior", "visits", "value_sum", "children", "expanded")
+
+    def __init__(self, h: int, prior: float) -> None:
+        self.hash = h
+        self.prior = prior
+        self.visits = 0
+        # From the point of view of the player who moved into this node
+        self.value_sum = 0.0
+        self.children: Dict[Move, "Node"] = {}
+        self.expanded = False
+
+
+class MCTS:
+    def __init__(
+        self,
+        evaluator,
+        c_puct: float = 1.5,
+        batch_size: int = 16,
+        virtual_loss: int = 1,
+    ) -> None:
+        self.evaluator = evaluator
+        self.c_puct = c_puct
+        self.batch_size = batch_size
+        self.virtual_loss = virtual_loss
+        self.root: Optional[Node] = None
+        self.playouts = 0
+        self.playouts_per_second = 0.0
+
+    def _find_root(self, h: int) -> Node:
+        # Reuse the subtree of the previous search when the new position is
+        # the root itself or one of its children or grandchildren
+        if self.root is not None:
+            if self.root.hash == h:
+                return self.root
+            for child in self.root.children.values():
+                if child.hash == h:
+                    return child
+                for grandchild in child.children.values():
+                    if grandchild.hash == h:
+                        return grandchild
+        return Node(h, 1.0)
+
+    def _select(self, node: Node) -> Tuple[Move, Node]:
+        sqrt_visits = math.sqrt(node.visits + 1)
+        best_score = -float("inf")
+        best = None
+        for move, child in node.children.items():
+            q = child.value_sum / child.visits if child.visits else 0.0
+            score = q + self.c_puct * child.prior * sqrt_visits / (1 + child.visits)
+            if score > best_score:
+                best_score = score
+                best = (move, child)
+        return best
+
+    def _expand(self, node: Node, board: Board, player: int, logits: np.ndarray) -> None:
+        moves = legal_moves(board, player)
+        node.expanded = True
+        if not moves:
+            return
+        codes = [encode_move(mv) for mv in moves]
+        priors = logits[codes]
+        priors = np.exp(priors - priors.max())
+        priors /= priors.sum()
+        for mv, prior in zip(moves, priors):
+            node.children[mv] = Node(update_hash(node.hash, board, mv), float(prior))
+
+    def _terminal_value(self, board: Board, player: int, h: int, seen: Iterable[int]) -> Optional[float]:
+        # Value for ``player``, the player to move, when the line ends here
+        cells = board.cells
+        if CASTLE_CODES[player] not in cells:
+            return -1.0
+        if CASTLE_CODES[1 - player] not in cells:
+            return 1.0
+        if h in seen:
+            # Repetition of a position of the game or of this line
+            return 0.0
+        return None
+
+    def _backup(self, path: List[Node], value: float) -> None:
+        # ``value`` is for the player to move at the leaf; the virtual loss
+        # added while selecting the path is removed on the way up
+        for node in reversed(path):
+            value = -value
+            node.visits += 1 - self.virtual_loss
+            node.value_sum += self.virtual_loss + value
+
+    def search(
+        self,
+        board: Board,
+        player: int,
+        playouts: int = 800,
+        max_time: Optional[float] = None,
+        history: Optional[Iterable[int]] = None,
+    ) -> Optional[Move]:
+        start = time.time()
+        # Forced moves return before any playout
+        self.playouts = 0
+        self.playouts_per_second = 0.0
+        h = position_hash(board, player)
+        root = self.root = self._find_root(h)
+        game_seen = set(history or ())
+        if not root.expanded:
+            logits, _ = self.evaluator.evaluate([board], [player])
+            self._expand(root, board, player, logits[0])
+        if not root.children:
+            return None
+        if len(root.children) == 1:
+            return next(iter(root.children))
+
+        done = 0
+        while done < playouts:
+            if max_time is not None and time.time() - start >= max_time:
+                break
+            leaves = []
+            pending = set()
+            for _ in range(min(self.batch_size, playouts - done)):
+                node = root
+                path = [root]
+                b = board.copy()
+                p = player
+                line = set(game_seen)
+                value = None
+                while node.expanded and node.children:
+                    line.add(node.hash)
+                    move, node = self._select(node)
+                    b.move_piece(move)
+                    p = 1 - p
+                    path.append(node)
+                    node.visits += self.virtual_loss
+                    node.value_sum -= self.virtual_loss
+                    value = self._terminal_value(b, p, node.hash, line)
+                    if value is not None:
+                        break
+                if value is None and node.expanded:
+                    # No legal move: the player to move loses
+                    value = -1.0
+                if value is not None:
+                    self._backup(path[1:], value)
+                    root.visits += 1
+                    done += 1
+                    continue
+                if id(node) in pending:
+                    # Already queued in this batch, undo and evaluate now
+                    for n in path[1:]:
+                        n.visits -= self.virtual_loss
+                        n.value_sum += self.virtual_loss
+                    break
+                pending.add(id(node))
+                leaves.append((path, node, b, p))
+            if leaves:
+                logits, values = self.evaluator.evaluate(
+                    [leaf[2] for leaf in leaves], [leaf[3] for leaf in leaves]
+                )
+                for (path, node, b, p), leaf_logits, value in zip(leaves, logits, values):
+                    self._expand(node, b, p, leaf_logits)
+                    self._backup(path[1:], float(value))
+                    root.visits += 1
+                done += len(leaves)
+        elapsed = time.time() - start
+        self.playouts = done
+        self.playouts_per_second = done / elapsed if elapsed > 0 else 0.0
+        return max(root.children.items(), key=lambda item: item[1].visits)[0]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Entraîne le réseau du moteur mcts sur des parties enregistrées")
+    parser.add_argument("records", nargs="+", help="Fichiers de parties")
+    parser.add_argument("-out", default=MODEL_PATH, help="Fichier des poids du réseau")
+    parser.add_argument("-epochs", type=int, default=10, help="Nombre de passes sur les positions")
+    parser.add_argument("-lr", type=float, default=1e-3, help="Pas d'apprentissage")
+    parser.add_argument("-max-positions", type=int, default=None, help="Nombre maximal de positions")
+    args = parser.parse_args()
+
+    planes, actions, values = load_examples(args.records, args.max_positions)
+    print(f"{len(actions)} positions")
+    model = None
+    if os.path.exists(args.out):
+        # Continue from the current weights
+        model = NetworkEvaluator.load(args.out).model
+    model = train_network(planes, actions, values, model=model, epochs=args.epochs, lr=args.lr)
+    tmp_path = args.out + ".tmp"
+    torch.save(model.state_dict(), tmp_path)
+    os.replace(tmp_path, args.out)
+    print(f"Réseau écrit dans {args.out}")
+
+
+if __name__ == "__main__":
+    main()
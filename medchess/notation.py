@@ -0,0 +1,87 @@
+# Text notation for MedChess positions and moves
+from typing import Tuple
+
+from .board import Board, Move, BOARD_HEIGHT, BOARD_WIDTH
+from .pieces import Piece, PieceType
+
+# Player 0 pieces are upper case, player 1 pieces lower case
+_PIECE_LETTERS = {ptype: ptype.value for ptype in PieceType}
+_LETTER_PIECES = {letter: ptype for ptype, letter in _PIECE_LETTERS.items()}
+COLUMNS = "abcdefg"[:BOARD_WIDTH]
+
+
+def board_to_fen(board: Board, player: int = 0) -> str:
+    """Encode a position as ``rows/separated/by/slashes player``.
+
+    Rows go from row 0 (top, player 1 side) to the bottom row, runs of empty
+    squares are written as digits, e.g. ``nngcgnn/sssssss/7/7/SSSSSSS/NNGCGNN 0``.
+    """
+    rows = []
+    for r in range(BOARD_HEIGHT):
+        row = ""
+        empty = 0
+        for c in range(BOARD_WIDTH):
+            piece = board.get_piece(r, c)
+            if piece is None:
+                empty += 1
+                continue
+            if empty:
+                row += str(empty)
+                empty = 0
+            letter = _PIECE_LETTERS[piece.type]
+            row += letter if piece.player == 0 else letter.lower()
+        if empty:
+            row += str(empty)
+        rows.append(row)
+    return f"{'/'.join(rows)} {player}"
+
+
+def board_from_fen(text: str) -> Tuple[Board, int]:
+    parts = text.split()
+    if not parts or len(parts) > 2:
+        raise ValueError(f"Invalid position: {text!r}")
+    player = int(parts[1]) if len(parts) == 2 else 0
+    if player not in (0, 1):
+        raise ValueError(f"Invalid player in position: {text!r}")
+    rows = parts[0].split("/")
+    if len(rows) != BOARD_HEIGHT:
+        raise ValueError(f"Expected {BOARD_HEIGHT} rows in position: {text!r}")
+    board = Board()
+    for r, row in enumerate(rows):
+        c = 0
+        for ch in row:
+            if ch.isdigit():
+                for _ in range(int(ch)):
+                    if c < BOARD_WIDTH:
+                        board.set_piece(r, c, None)
+                    c += 1
+                continue
+            ptype = _LETTER_PIECES.get(ch.upper())
+            if ptype is None or c >= BOARD_WIDTH:
+                raise ValueError(f"Invalid row {row!r} in position: {text!r}")
+            board.set_piece(r, c, Piece(ptype, 0 if ch.isupper() else 1))
+            c += 1
+        if c != BOARD_WIDTH:
+            raise ValueError(f"Invalid row {row!r} in position: {text!r}")
+    return board, player
+
+
+def square_name(r: int, c: int) -> str:
+    # Columns are letters, rows keep the indices used by the terminal prompt
+    return f"{COLUMNS[c]}{r}"
+
+
+def move_to_str(move: Move) -> str:
+    fr, fc, tr, tc = move
+    return square_name(fr, fc) + square_name(tr, tc)
+
+
+def move_from_str(text: str) -> Move:
+    text = text.strip()
+    if len(text) != 4 or text[0] not in COLUMNS or text[2] not in COLUMNS:
+        raise ValueError(f"Invalid move: {text!r}")
+    try:
+        fr, tr = int(text[1]), int(text[3])
+    except ValueError:
+        raise ValueError(f"Invalid move: {text!r}") from None
+    return fr, COLUMNS.index(text[0]), tr, COLUMNS.index(text[2])
@@ -7,9 +7,31 @@ class PieceType(Enum):
     CASTLE = "C"
 
 class Piece:
+    __slots__ = ("type", "player")
+
     def __init__(self, piece_type: PieceType, player: int):
         self.type = piece_type
         self.player = player  # 0 or 1
 
     def __repr__(self):
         return f"{self.type.value}{self.player}"
+
+# Square encoding shared by Board storage and the RL observations:
+# 0 is empty, 1-4 are player 0 pieces and 5-8 the same pieces for player 1
+PIECE_CODES = {
+    PieceType.SWORDSMAN: 1,
+    PieceType.KNIGHT: 2,
+    PieceType.GENERAL: 3,
+    PieceType.CASTLE: 4,
+}
+CASTLE_CODES = (PIECE_CODES[PieceType.CASTLE], PIECE_CODES[PieceType.CASTLE] + 4)
+
+def piece_code(piece: Piece) -> int:
+    return PIECE_CODES[piece.type] + 4 * piece.player
+
+# One shared Piece per code, returned by Board.get_piece
+PIECES = [None] + [
+    Piece(ptype, player)
+    for player in (0, 1)
+    for ptype in sorted(PIECE_CODES, key=PIECE_CODES.get)
+]
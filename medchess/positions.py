@@ -0,0 +1,270 @@
+# On-disk index of positions reached in recorded games
+#
+# The index file is an open-addressing hash table: a header (HEADER) followed
+# by ``capacity`` slots (SLOT) keyed by the Zobrist hash of the position and
+# the player to move. Lookups go through a memory map and only touch the
+# slots probed. The record files already indexed, with the offset reached in
+# each, are stored as JSON after the slots so that rebuilding only replays
+# games appended since the previous run. Updates are made on a copy that
+# replaces the index once complete, so the counts and the offsets always
+# change together.
+import argparse
+import json
+import mmap
+import os
+import shutil
+import struct
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from .board import Board, Move
+from .notation import board_from_fen, move_to_str
+from .record import DRAW, iter_records
+from .rules import legal_moves
+from .zobrist import position_hash, update_hash
+
+MAGIC = b"MCX1"
+HEADER = struct.Struct("<4sIQQ")  # magic, sources size, capacity, used slots
+SLOT = struct.Struct("<QIII")  # hash, games, wins of player 0, wins of player 1
+_KEY = struct.Struct("<Q")
+MAX_LOAD = 0.7
+MIN_CAPACITY = 1 << 16
+
+
+@dataclass
+class PositionStats:
+    games: int
+    wins: Tuple[int, int]
+
+    @property
+    def draws(self) -> int:
+        return self.games - self.wins[0] - self.wins[1]
+
+    def score(self, player: int) -> float:
+        return (self.wins[player] + 0.5 * self.draws) / self.games
+
+
+def _key(h: int) -> int:
+    # Zero marks an empty slot
+    return h or 1
+
+
+def _create(path: str, capacity: int) -> None:
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, 0, capacity, 0))
+        f.truncate(HEADER.size + capacity * SLOT.size)
+
+
+class PositionIndex:
+    def __init__(self, path: str, writable: bool = False) -> None:
+        self.path = path
+        self.writable = writable
+        if writable and not os.path.exists(path):
+            _create(path, MIN_CAPACITY)
+        self._open()
+
+    def _open(self) -> None:
+        self._file = open(self.path, "r+b" if self.writable else "rb")
+        access = mmap.ACCESS_WRITE if self.writable else mmap.ACCESS_READ
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=access)
+        magic, sources_size, self.capacity, self.used = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{self.path} is not a MedChess position index")
+        self._mask = self.capacity - 1
+        end = self._table_end()
+        # Absolute path of each record file indexed -> offset reached
+        self.sources: Dict[str, int] = (
+            json.loads(self._mm[end:end + sources_size].decode("utf-8")) if sources_size else {}
+        )
+
+    def _table_end(self) -> int:
+        return HEADER.size + self.capacity * SLOT.size
+
+    def close(self) -> None:
+        self._mm.close()
+        if self.writable:
+            sources = json.dumps(self.sources).encode("utf-8")
+            self._file.seek(self._table_end())
+            self._file.write(sources)
+            self._file.truncate()
+            self._file.seek(0)
+            self._file.write(HEADER.pack(MAGIC, len(sources), self.capacity, self.used))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        self._file.close()
+
+    def __enter__(self) -> "PositionIndex":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def _find(self, key: int) -> Tuple[int, bool]:
+        slot = key & self._mask
+        while True:
+            offset = HEADER.size + slot * SLOT.size
+            (found,) = _KEY.unpack_from(self._mm, offset)
+            if found == key:
+                return offset, True
+            if found == 0:
+                return offset, False
+            slot = (slot + 1) & self._mask
+
+    def lookup(self, h: int) -> Optional[PositionStats]:
+        offset, found = self._find(_key(h))
+        if not found:
+            return None
+        _, games, wins0, wins1 = SLOT.unpack_from(self._mm, offset)
+        return PositionStats(games, (wins0, wins1))
+
+    def probe(self, board: Board, player: int) -> Optional[PositionStats]:
+        return self.lookup(position_hash(board, player))
+
+    def continuations(self, board: Board, player: int) -> List[Tuple[Move, PositionStats]]:
+        """Known replies from this position, most played first."""
+        h = position_hash(board, player)
+        result = []
+        for move in legal_moves(board, player):
+            stats = self.lookup(update_hash(h, board, move))
+            if stats is not None:
+                result.append((move, stats))
+        result.sort(key=lambda item: item[1].games, reverse=True)
+        return result
+
+    def best_move(self, board: Board, player: int, min_games: int = 1) -> Optional[Move]:
+        candidates = [
+            (stats.score(player), move)
+            for move, stats in self.continuations(board, player)
+            if stats.games >= min_games
+        ]
+        if not candidates:
+            return None
+        return max(candidates)[1]
+
+    def entries(self) -> Iterable[Tuple[int, int, int, int]]:
+        for slot in range(self.capacity):
+            entry = SLOT.unpack_from(self._mm, HEADER.size + slot * SLOT.size)
+            if entry[0]:
+                yield entry
+
+    def _add(self, key: int, games: int, wins0: int, wins1: int) -> None:
+        offset, found = self._find(key)
+        if found:
+            _, g, w0, w1 = SLOT.unpack_from(self._mm, offset)
+            games, wins0, wins1 = games + g, wins0 + w0, wins1 + w1
+        else:
+            self.used += 1
+        SLOT.pack_into(self._mm, offset, key, games, wins0, wins1)
+
+    def merge(self, counts: Dict[int, List[int]]) -> None:
+        if not self.writable:
+            raise ValueError("Index opened read-only")
+        if self.used + len(counts) > self.capacity * MAX_LOAD:
+            self._grow(self.used + len(counts))
+        for h, (games, wins0, wins1) in counts.items():
+            self._add(_key(h), games, wins0, wins1)
+
+    def _grow(self, needed: int) -> None:
+        capacity = self.capacity
+        while needed > capacity * MAX_LOAD:
+            capacity *= 2
+        # The larger table is filled slot by slot beside the current one,
+        # which stays intact until the new file replaces it
+        tmp_path = self.path + ".grow"
+        _create(tmp_path, capacity)
+        with PositionIndex(tmp_path, writable=True) as grown:
+            for key, games, wins0, wins1 in self.entries():
+                grown._add(key, games, wins0, wins1)
+            grown.sources = self.sources
+        self._mm.close()
+        self._file.close()
+        os.replace(tmp_path, self.path)
+        self._open()
+
+
+# Games counted in memory before their positions are merged into the table
+MERGE_GAMES = 10000
+
+
+def _count_game(record, counts: Dict[int, List[int]]) -> None:
+    board, player = record.start_board()
+    h = position_hash(board, player)
+    seen = {h}
+    for move in record.moves:
+        h = update_hash(h, board, move)
+        board.move_piece(move)
+        seen.add(h)
+    for h in seen:
+        entry = counts.get(h)
+        if entry is None:
+            entry = counts[h] = [0, 0, 0]
+        entry[0] += 1
+        if record.result != DRAW:
+            entry[1 + record.result] += 1
+
+
+def count_positions(
+    record_path: str, offset: int = 0, counts: Optional[Dict[int, List[int]]] = None
+) -> Tuple[Dict[int, List[int]], int]:
+    """Replay the games after ``offset`` and count every position reached."""
+    counts = {} if counts is None else counts
+    for offset, record in iter_records(record_path, offset):
+        if record.result in (0, 1, DRAW):
+            _count_game(record, counts)
+    return counts, offset
+
+
+def build_index(index_path: str, record_paths: Iterable[str], merge_games: int = MERGE_GAMES) -> int:
+    """Add the games not yet indexed to ``index_path``, return the new positions."""
+    # Work on a copy: a crash leaves the previous index and its offsets
+    tmp_path = index_path + ".tmp"
+    if os.path.exists(index_path):
+        shutil.copyfile(index_path, tmp_path)
+    elif os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    with PositionIndex(tmp_path, writable=True) as index:
+        used = index.used
+        for record_path in record_paths:
+            key = os.path.abspath(record_path)
+            counts: Dict[int, List[int]] = {}
+            games = 0
+            for offset, record in iter_records(record_path, index.sources.get(key, 0)):
+                if record.result in (0, 1, DRAW):
+                    _count_game(record, counts)
+                    games += 1
+                index.sources[key] = offset
+                if games >= merge_games:
+                    # Bounded memory: the counts go to the table every few games
+                    index.merge(counts)
+                    counts.clear()
+                    games = 0
+            index.merge(counts)
+        added = index.used - used
+    os.replace(tmp_path, index_path)
+    return added
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Indexe les positions des parties enregistrées")
+    parser.add_argument("index", help="Fichier d'index des positions")
+    parser.add_argument("records", nargs="*", help="Fichiers de parties à indexer")
+    parser.add_argument("-query", default=None, help="Position à consulter (notation FEN)")
+    args = parser.parse_args()
+
+    if args.records:
+        added = build_index(args.index, args.records)
+        print(f"{added} nouvelles positions indexées")
+    if args.query:
+        board, player = board_from_fen(args.query)
+        with PositionIndex(args.index) as index:
+            stats = index.probe(board, player)
+            if stats is None:
+                print("Position inconnue")
+                return
+            print(f"{stats.games} parties, {stats.wins[0]} / {stats.draws} / {stats.wins[1]}")
+            for move, child in index.continuations(board, player):
+                print(f"{move_to_str(move)} {child.games} parties, score {child.score(player):.2f}")
+
+
+if __name__ == "__main__":
+    main()
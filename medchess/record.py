@@ -0,0 +1,208 @@
+# Compact binary game records
+#
+# A record file starts with MAGIC and holds a sequence of games. Each game is
+# a fixed header (HEADER), the UTF-8 player names, an optional start position
+# in FEN-like notation (empty for the standard start) and one little-endian
+# uint16 per move holding ``from_square * SQUARES + to_square``.
+import mmap
+import os
+import struct
+import sys
+from array import array
+from dataclasses import dataclass, field
+from typing import BinaryIO, Iterator, List, Optional, Tuple
+
+from .board import Board, Move, BOARD_WIDTH, SQUARES
+from .notation import board_from_fen
+
+MAGIC = b"MCR1"
+# name lengths, start position length, powers, result, reason, move count
+HEADER = struct.Struct("<BBBBBBBH")
+
+DRAW = 2
+UNKNOWN = 3
+REASONS = (
+    "",
+    "castle",
+    "no_moves",
+    "repetition",
+    "no_progress",
+    "max_plies",
+    "timeout",
+    "illegal",
+    "abandoned",
+)
+
+
+@dataclass
+class GameRecord:
+    players: Tuple[str, str] = ("", "")
+    powers: Tuple[int, int] = (0, 0)
+    # Winning player, DRAW or UNKNOWN
+    result: int = UNKNOWN
+    reason: str = ""
+    moves: List[Move] = field(default_factory=list)
+    start: str = ""
+
+    def start_board(self) -> Tuple[Board, int]:
+        if self.start:
+            return board_from_fen(self.start)
+        return Board(), 0
+
+
+def encode_move(move: Move) -> int:
+    fr, fc, tr, tc = move
+    return (fr * BOARD_WIDTH + fc) * SQUARES + tr * BOARD_WIDTH + tc
+
+
+def decode_move(code: int) -> Move:
+    src, dst = divmod(code, SQUARES)
+    return src // BOARD_WIDTH, src % BOARD_WIDTH, dst // BOARD_WIDTH, dst % BOARD_WIDTH
+
+
+# Lookup table so that replay does not divide for every move
+_DECODED = [decode_move(code) for code in range(SQUARES * SQUARES)]
+
+
+def _encode_moves(moves: List[Move]) -> bytes:
+    codes = array("H", (encode_move(m) for m in moves))
+    if sys.byteorder == "big":
+        codes.byteswap()
+    return codes.tobytes()
+
+
+def _decode_moves(data) -> List[Move]:
+    codes = array("H")
+    codes.frombytes(data)
+    if sys.byteorder == "big":
+        codes.byteswap()
+    return [_DECODED[code] for code in codes]
+
+
+def _encode_name(name: str) -> bytes:
+    # At most 255 bytes, cut on a character boundary
+    return name.encode("utf-8")[:255].decode("utf-8", "ignore").encode("utf-8")
+
+
+def pack_record(record: GameRecord) -> bytes:
+    names = [_encode_name(name) for name in record.players]
+    start = record.start.encode("ascii")
+    header = HEADER.pack(
+        len(names[0]),
+        len(names[1]),
+        len(start),
+        record.powers[0],
+        record.powers[1],
+        record.result,
+        REASONS.index(record.reason),
+        len(record.moves),
+    )
+    return header + names[0] + names[1] + start + _encode_moves(record.moves)
+
+
+def save_record(path: Optional[str], record: GameRecord, result: int, reason: str) -> None:
+    """Set the outcome of ``record`` and append it to ``path`` if one is given."""
+    if path is None:
+        return
+    record.result = result
+    record.reason = reason
+    with RecordWriter(path) as writer:
+        writer.write(record)
+
+
+def _complete_size(path: str) -> int:
+    """Size of ``path`` up to the end of its last complete game, 0 if empty."""
+    with open(path, "rb") as f:
+        head = f.read(len(MAGIC))
+    if len(head) < len(MAGIC) and MAGIC.startswith(head):
+        return 0
+    if head != MAGIC:
+        raise ValueError(f"{path} is not a MedChess record file")
+    end = len(MAGIC)
+    for end, _ in iter_records(path):
+        pass
+    return end
+
+
+class RecordWriter:
+    """Append games to a record file, buffering writes."""
+
+    def __init__(self, path: str, buffer_size: int = 1 << 16) -> None:
+        self.path = path
+        end = _complete_size(path) if os.path.exists(path) else 0
+        self.file: BinaryIO = open(path, "ab", buffering=buffer_size)
+        if self.file.tell() != end:
+            # Drop the partial game left by an interrupted writer, games
+            # appended after it would be read as its moves
+            self.file.truncate(end)
+        if end == 0:
+            self.file.write(MAGIC)
+
+    def write(self, record: GameRecord) -> None:
+        self.file.write(pack_record(record))
+
+    def flush(self) -> None:
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+    def __enter__(self) -> "RecordWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def iter_records(path: str, offset: int = 0) -> Iterator[Tuple[int, GameRecord]]:
+    """Yield ``(end_offset, record)`` for the games stored after ``offset``.
+
+    Passing the last ``end_offset`` back resumes reading after that game,
+    which lets readers pick up games appended since their previous pass.
+    """
+    if os.path.getsize(path) == 0:
+        return
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        if buf[: len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a MedChess record file")
+        offset = max(offset, len(MAGIC))
+        end = len(buf)
+        # A truncated trailing game (interrupted writer) is ignored
+        while offset + HEADER.size <= end:
+            name0, name1, start_len, power0, power1, result, reason, count = HEADER.unpack_from(buf, offset)
+            offset += HEADER.size
+            players = (
+                # Files written before names were cut on character
+                # boundaries may hold a split character
+                buf[offset : offset + name0].decode("utf-8", "replace"),
+                buf[offset + name0 : offset + name0 + name1].decode("utf-8", "replace"),
+            )
+            offset += name0 + name1
+            start = buf[offset : offset + start_len].decode("ascii")
+            offset += start_len
+            if offset + 2 * count > end:
+                return
+            moves = _decode_moves(buf[offset : offset + 2 * count])
+            offset += 2 * count
+            yield offset, GameRecord(players, (power0, power1), result, REASONS[reason], moves, start)
+
+
+def read_records(path: str) -> Iterator[GameRecord]:
+    for _, record in iter_records(path):
+        yield record
+
+
+def replay(record: GameRecord) -> Iterator[Tuple[Board, int, Move]]:
+    """Yield ``(board, player, move)`` before each move of the game.
+
+    The same board is updated in place, copy it to keep a position.
+    """
+    board, player = record.start_board()
+    cells = board.cells
+    for move in record.moves:
+        yield board, player, move
+        fr, fc, tr, tc = move
+        src = fr * BOARD_WIDTH + fc
+        cells[tr * BOARD_WIDTH + tc] = cells[src]
+        cells[src] = 0
+        player = 1 - player
@@ -0,0 +1,196 @@
+# Compact, memory-mapped replay buffer for the DQN
+#
+# Each transition stores its observation once, packed two squares per byte
+# (square codes fit in 4 bits), with the action, reward and done flag. The
+# next observation is not stored: it is either the same board (illegal
+# action) or the board with the action's move applied, and is rebuilt when
+# sampling. Any other next observation is kept in a sparse side file.
+# Both files are memory-mapped, so the buffer can be larger than RAM and
+# survives between training runs.
+import os
+from typing import Any, Dict, List
+
+import numpy as np
+from gym import spaces
+from stable_baselines3.common.buffers import BaseBuffer, ReplayBuffer
+from stable_baselines3.common.type_aliases import ReplayBufferSamples
+
+from .board import SQUARES
+
+BUFFER_PATH = os.path.join(os.path.dirname(__file__), "replay.buf")
+MAGIC = b"MCB1"
+PACKED = SQUARES // 2
+
+NEXT_SAME = 0
+NEXT_MOVED = 1
+NEXT_STORED = 2
+
+HEADER = np.dtype([
+    ("magic", "S4"),
+    ("buffer_size", "<i8"),
+    ("n_envs", "<i8"),
+    ("pos", "<i8"),
+    ("full", "<i8"),
+])
+TRANSITION = np.dtype([
+    ("obs", np.uint8, (PACKED,)),
+    ("action", "<u2"),
+    ("reward", "<f4"),
+    ("done", np.uint8),
+    ("next", np.uint8),
+])
+
+
+def pack_obs(cells: np.ndarray) -> np.ndarray:
+    """``(N, 42)`` square codes to ``(N, 21)`` bytes."""
+    return (cells[:, 0::2] << 4) | cells[:, 1::2]
+
+
+def unpack_obs(packed: np.ndarray) -> np.ndarray:
+    cells = np.empty((len(packed), SQUARES), dtype=np.uint8)
+    cells[:, 0::2] = packed >> 4
+    cells[:, 1::2] = packed & 0x0F
+    return cells
+
+
+def apply_actions(cells: np.ndarray, actions: np.ndarray) -> np.ndarray:
+    """Boards after moving the piece of each action, as MedChessEnv.step does."""
+    moved = cells.copy()
+    rows = np.arange(len(cells))
+    src = actions // SQUARES
+    dst = actions % SQUARES
+    moved[rows, dst] = cells[rows, src]
+    moved[rows, src] = 0
+    return moved
+
+
+def _ensure_size(path: str, size: int) -> None:
+    # Creates or extends the file; truncating leaves it sparse until
+    # transitions are written
+    with open(path, "ab") as f:
+        if f.tell() < size:
+            f.truncate(size)
+
+
+class MmapReplayBuffer(ReplayBuffer):
+    def __init__(
+        self,
+        buffer_size: int,
+        observation_space: spaces.Space,
+        action_space: spaces.Space,
+        device: Any = "auto",
+        n_envs: int = 1,
+        optimize_memory_usage: bool = False,
+        handle_timeout_termination: bool = True,
+        path: str = BUFFER_PATH,
+    ) -> None:
+        # ReplayBuffer.__init__ would allocate the full arrays in RAM
+        BaseBuffer.__init__(self, buffer_size, observation_space, action_space, device, n_envs=n_envs)
+        self.optimize_memory_usage = False
+        self.handle_timeout_termination = handle_timeout_termination
+        self.path = path
+
+        size = HEADER.itemsize + self.buffer_size * self.n_envs * TRANSITION.itemsize
+        if os.path.exists(path):
+            header = np.fromfile(path, dtype=HEADER, count=1)[0]
+            if header["magic"] != MAGIC:
+                raise ValueError(f"{path} is not a MedChess replay buffer")
+            if (header["buffer_size"], header["n_envs"]) != (self.buffer_size, self.n_envs):
+                raise ValueError(
+                    f"{path} holds {header['buffer_size']} x {header['n_envs']} transitions, "
+                    f"not {self.buffer_size} x {self.n_envs}"
+                )
+        else:
+            _ensure_size(path, size)
+            header = np.zeros((), dtype=HEADER)
+            header["magic"] = MAGIC
+            header["buffer_size"] = self.buffer_size
+            header["n_envs"] = self.n_envs
+            with open(path, "r+b") as f:
+                f.write(header.tobytes())
+
+        # The side file may be missing when only the main file was copied;
+        # the next observations it held are then read as empty boards
+        _ensure_size(path + ".next", self.buffer_size * self.n_envs * PACKED)
+        self.header = np.memmap(path, dtype=HEADER, mode="r+", shape=(1,))
+        self.transitions = np.memmap(
+            path, dtype=TRANSITION, mode="r+", offset=HEADER.itemsize,
+            shape=(self.buffer_size, self.n_envs),
+        )
+        self.stored_next = np.memmap(
+            path + ".next", dtype=np.uint8, mode="r+",
+            shape=(self.buffer_size, self.n_envs, PACKED),
+        )
+        self.pos = int(self.header[0]["pos"])
+        self.full = bool(self.header[0]["full"])
+
+    def _save_position(self) -> None:
+        self.header[0]["pos"] = self.pos
+        self.header[0]["full"] = int(self.full)
+
+    def reset(self) -> None:
+        super().reset()
+        self._save_position()
+
+    def add(
+        self,
+        obs: np.ndarray,
+        next_obs: np.ndarray,
+        action: np.ndarray,
+        reward: np.ndarray,
+        done: np.ndarray,
+        infos: List[Dict[str, Any]],
+    ) -> None:
+        cells = np.asarray(obs).reshape(self.n_envs, SQUARES).astype(np.uint8)
+        next_cells = np.asarray(next_obs).reshape(self.n_envs, SQUARES).astype(np.uint8)
+        actions = np.asarray(action).reshape(self.n_envs).astype(np.int64)
+        kind = np.full(self.n_envs, NEXT_STORED, dtype=np.uint8)
+        kind[(cells == next_cells).all(axis=1)] = NEXT_SAME
+        kind[(apply_actions(cells, actions) == next_cells).all(axis=1)] = NEXT_MOVED
+        done = np.asarray(done).reshape(self.n_envs).astype(bool)
+        if self.handle_timeout_termination:
+            done &= ~np.array([info.get("TimeLimit.truncated", False) for info in infos])
+
+        row = self.transitions[self.pos]
+        row["obs"] = pack_obs(cells)
+        row["action"] = actions
+        row["reward"] = np.asarray(reward).reshape(self.n_envs)
+        row["done"] = done
+        row["next"] = kind
+        stored = np.nonzero(kind == NEXT_STORED)[0]
+        if stored.size:
+            self.stored_next[self.pos, stored] = pack_obs(next_cells[stored])
+
+        self.pos += 1
+        if self.pos == self.buffer_size:
+            self.full = True
+            self.pos = 0
+        self._save_position()
+
+    def _get_samples(self, batch_inds: np.ndarray, env=None) -> ReplayBufferSamples:
+        env_indices = np.random.randint(0, high=self.n_envs, size=(len(batch_inds),))
+        batch = self.transitions[batch_inds, env_indices]
+        cells = unpack_obs(batch["obs"])
+        actions = batch["action"].astype(np.int64)
+
+        next_cells = cells.copy()
+        moved = np.nonzero(batch["next"] == NEXT_MOVED)[0]
+        next_cells[moved] = apply_actions(cells[moved], actions[moved])
+        stored = np.nonzero(batch["next"] == NEXT_STORED)[0]
+        if stored.size:
+            next_cells[stored] = unpack_obs(self.stored_next[batch_inds[stored], env_indices[stored]])
+
+        dtype = self.observation_space.dtype
+        data = (
+            self._normalize_obs(cells.astype(dtype).reshape(-1, *self.obs_shape), env),
+            actions.reshape(-1, self.action_dim),
+            self._normalize_obs(next_cells.astype(dtype).reshape(-1, *self.obs_shape), env),
+            batch["done"].astype(np.float32).reshape(-1, 1),
+            self._normalize_reward(batch["reward"].astype(np.float32).reshape(-1, 1), env),
+        )
+        return ReplayBufferSamples(*tuple(map(self.to_torch, data)))
+
+    def flush(self) -> None:
+        self.header.flush()
+        self.transitions.flush()
+        self.stored_next.flush()
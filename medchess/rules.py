@@ -1,7 +1,9 @@
-from typing import List
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
 
 from .board import Board, Move, BOARD_HEIGHT, BOARD_WIDTH
 from .pieces import PieceType
+from .zobrist import position_hash, update_hash
 
 # Directions for swordsman (orthogonal)
 ORTHO_DIRS = [(-1, 0), (1, 0), (0, -1), (0, 1)]
@@ -59,3 +61,90 @@ def _diagonal_moves(board: Board, r: int, c: int, distance: int) -> List[Move]:
             else:
                 break
     return moves
+
+def is_legal(board: Board, move: Move, player: Optional[int] = None) -> bool:
+    """Check a single move against the moving piece's pattern and path.
+
+    Equivalent to ``move in legal_moves(board, player)`` without generating
+    the other moves. When ``player`` is omitted any side may move.
+    """
+    fr, fc, tr, tc = move
+    if not (board.in_bounds(fr, fc) and board.in_bounds(tr, tc)):
+        return False
+    piece = board.get_piece(fr, fc)
+    if piece is None or (player is not None and piece.player != player):
+        return False
+    target = board.get_piece(tr, tc)
+    if target is not None and target.player == piece.player:
+        return False
+    dr, dc = tr - fr, tc - fc
+    adr, adc = abs(dr), abs(dc)
+    if piece.type == PieceType.SWORDSMAN:
+        return adr + adc == 1
+    if piece.type == PieceType.KNIGHT:
+        return adr == 1 and adc == 1
+    if piece.type == PieceType.GENERAL:
+        if adr == 1 and adc == 1:
+            return True
+        if adr + adc == 1:
+            return True
+        if (adr, adc) in ((2, 0), (0, 2)):
+            # The intermediate square must be empty
+            return board.get_piece(fr + dr // 2, fc + dc // 2) is None
+    return False
+
+class LegalMoveCache:
+    """Legal moves of recently seen positions, keyed by Zobrist hash."""
+
+    def __init__(self, size: int = 1 << 12) -> None:
+        self.size = size
+        self._entries: Dict[int, Tuple[Move, ...]] = {}
+
+    def moves(self, board: Board, player: int, h: Optional[int] = None) -> Tuple[Move, ...]:
+        if h is None:
+            h = position_hash(board, player)
+        moves = self._entries.get(h)
+        if moves is None:
+            if len(self._entries) >= self.size:
+                # Evict the oldest position
+                del self._entries[next(iter(self._entries))]
+            moves = self._entries[h] = tuple(legal_moves(board, player))
+        return moves
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+@dataclass
+class DrawRule:
+    # Draw once the same position occurs this many times (0 disables)
+    repetitions: int = 3
+    # Draw after this many plies without a capture (0 disables)
+    no_progress: int = 50
+
+class PositionHistory:
+    """Hashes of the positions reached in a game, to apply a DrawRule."""
+
+    def __init__(self, board: Board, player: int, rule: Optional[DrawRule] = None) -> None:
+        self.rule = rule or DrawRule()
+        self.hash = position_hash(board, player)
+        self.hashes: List[int] = [self.hash]
+        self.counts: Dict[int, int] = {self.hash: 1}
+        self.quiet = 0
+
+    def push(self, board: Board, move: Move) -> None:
+        # Called with the board as it is before ``move`` is played
+        fr, fc, tr, tc = move
+        self.hash = update_hash(self.hash, board, move)
+        self.hashes.append(self.hash)
+        self.counts[self.hash] = self.counts.get(self.hash, 0) + 1
+        if board.get_code(tr, tc):
+            self.quiet = 0
+        else:
+            self.quiet += 1
+
+    def draw_reason(self) -> Optional[str]:
+        if self.rule.repetitions and self.counts[self.hash] >= self.rule.repetitions:
+            return "repetition"
+        if self.rule.no_progress and self.quiet >= self.rule.no_progress:
+            return "no_progress"
+        return None
@@ -0,0 +1,97 @@
+# Sprite atlas shared by the MedChess GUIs
+import functools
+import hashlib
+import os
+from typing import Dict, Tuple
+
+from PIL import Image
+
+from .pieces import PieceType
+
+IMG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "images")
+CACHE_DIR = os.path.join(IMG_DIR, ".cache")
+
+SPRITE_FILES = {
+    PieceType.SWORDSMAN: "epeiste.png",
+    PieceType.KNIGHT: "chevalier.png",
+    PieceType.GENERAL: "general.png",
+    PieceType.CASTLE: "chateau.png",
+}
+# Player 0 is tinted blue, player 1 red
+PLAYER_TINTS = {
+    0: (0, 0, 255, 80),
+    1: (255, 0, 0, 80),
+}
+
+Sprites = Dict[Tuple[PieceType, int], Image.Image]
+
+
+def _cache_key(cell_size: int) -> str:
+    h = hashlib.sha1(str(cell_size).encode())
+    for filename in SPRITE_FILES.values():
+        st = os.stat(os.path.join(IMG_DIR, filename))
+        h.update(f"{filename}:{st.st_mtime_ns}:{st.st_size}".encode())
+    return h.hexdigest()[:16]
+
+
+def _atlas_size(cell_size: int) -> Tuple[int, int]:
+    # One column per piece type, one row per player
+    return cell_size * len(SPRITE_FILES), cell_size * len(PLAYER_TINTS)
+
+
+def build_atlas(cell_size: int) -> Image.Image:
+    atlas = Image.new("RGBA", _atlas_size(cell_size))
+    for col, filename in enumerate(SPRITE_FILES.values()):
+        base = (
+            Image.open(os.path.join(IMG_DIR, filename))
+            .resize((cell_size, cell_size), Image.LANCZOS)
+            .convert("RGBA")
+        )
+        for player, tint in PLAYER_TINTS.items():
+            overlay = Image.new("RGBA", base.size, tint)
+            atlas.paste(
+                Image.alpha_composite(base, overlay),
+                (col * cell_size, player * cell_size),
+            )
+    return atlas
+
+
+def load_atlas(cell_size: int) -> Image.Image:
+    size = _atlas_size(cell_size)
+    prefix = f"sprites_{cell_size}_"
+    path = os.path.join(CACHE_DIR, f"{prefix}{_cache_key(cell_size)}.rgba")
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+        if len(data) == size[0] * size[1] * 4:
+            return Image.frombytes("RGBA", size, data)
+    except OSError:
+        pass
+
+    atlas = build_atlas(cell_size)
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        # Drop atlases built from older versions of the images
+        for name in os.listdir(CACHE_DIR):
+            if name.startswith(prefix):
+                os.remove(os.path.join(CACHE_DIR, name))
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(atlas.tobytes())
+        os.replace(tmp_path, path)
+    except OSError:
+        # A read-only install still works, it just rebuilds on each launch
+        pass
+    return atlas
+
+
+@functools.lru_cache(maxsize=None)
+def load_sprites(cell_size: int) -> Sprites:
+    atlas = load_atlas(cell_size)
+    sprites: Sprites = {}
+    for col, ptype in enumerate(SPRITE_FILES):
+        for player in PLAYER_TINTS:
+            x = col * cell_size
+            y = player * cell_size
+            sprites[(ptype, player)] = atlas.crop((x, y, x + cell_size, y + cell_size))
+    return sprites
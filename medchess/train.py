@@ -1,26 +1,300 @@
 import argparse
+import io
+import json
+import multiprocessing
 import os
+import queue
+import threading
 import time
+from typing import Callable, Optional
 
 from stable_baselines3 import DQN
+from stable_baselines3.common.callbacks import BaseCallback
 from stable_baselines3.dqn import MlpPolicy
 
 from .ai import MedChessEnv
+from .arena import Adjudication, EngineConfig, play_game
+from .replay_buffer import BUFFER_PATH, MmapReplayBuffer
 
+MODEL_DIR = os.path.dirname(__file__)
+MODEL_PATH = os.path.join(MODEL_DIR, "model.zip")
+METRICS_PATH = os.path.join(MODEL_DIR, "train_metrics.jsonl")
+# Snapshot played by the evaluation process, separate from the checkpoint
+EVAL_MODEL_PATH = os.path.join(MODEL_DIR, "model_eval.zip")
+BUFFER_SIZE = 1_000_000
+# Intervals in seconds
+METRICS_INTERVAL = 10.0
+CHECKPOINT_INTERVAL = 60.0
+EVAL_INTERVAL = 300.0
+EVAL_GAMES = 20
+EVAL_POWER = 1
 
-def train_model(max_seconds: int) -> None:
+
+def atomic_write(path: str, data: bytes) -> None:
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class CheckpointWriter(threading.Thread):
+    """Writes model snapshots to disk off the training thread."""
+
+    def __init__(self) -> None:
+        super().__init__(daemon=True)
+        self.queue: "queue.Queue" = queue.Queue()
+
+    def run(self) -> None:
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            path, data, done = item
+            atomic_write(path, data)
+            if done is not None:
+                done()
+
+    def save(self, model: DQN, path: str, done: Optional[Callable[[], None]] = None) -> None:
+        # Only serialising happens here, the weights must not change meanwhile
+        buf = io.BytesIO()
+        model.save(buf)
+        self.queue.put((path, buf.getvalue(), done))
+
+    def close(self) -> None:
+        self.queue.put(None)
+        self.join()
+
+
+def _init_eval_worker() -> None:
+    import torch
+
+    # Keep the evaluation to one core, behind the training process
+    torch.set_num_threads(1)
+    if hasattr(os, "nice"):
+        os.nice(5)
+
+
+def evaluate_model(model_path: str, games: int = EVAL_GAMES, power: int = EVAL_POWER) -> dict:
+    """Score of the DQN in ``model_path`` against the minimax bot, colours alternating."""
+    rl = EngineConfig(engine="rl", options={"model": model_path})
+    minimax = EngineConfig(power=power, personality="Equilibré")
+    wins = draws = 0
+    for i in range(games):
+        rl_player = i % 2
+        configs = (rl, minimax) if rl_player == 0 else (minimax, rl)
+        # Two random plies so that the deterministic policy sees varied games
+        winner, _, _ = play_game(configs, Adjudication(), opening_plies=2, seed=i // 2)
+        if winner is None:
+            draws += 1
+        elif winner == rl_player:
+            wins += 1
+    return {
+        "games": games,
+        "wins": wins,
+        "draws": draws,
+        "losses": games - wins - draws,
+        "score": (wins + 0.5 * draws) / games,
+    }
+
+
+class TrainingMonitor(BaseCallback):
+    """Metrics, periodic checkpoints and evaluations during DQN training.
+
+    Kept across the successive ``learn`` calls of train_model.
+    """
+
+    def __init__(
+        self,
+        model_path: str = MODEL_PATH,
+        metrics_path: Optional[str] = METRICS_PATH,
+        metrics_interval: float = METRICS_INTERVAL,
+        checkpoint_interval: float = CHECKPOINT_INTERVAL,
+        eval_interval: float = EVAL_INTERVAL,
+        eval_games: int = EVAL_GAMES,
+        eval_power: int = EVAL_POWER,
+    ) -> None:
+        super().__init__()
+        self.model_path = model_path
+        self.metrics_path = metrics_path
+        self.metrics_interval = metrics_interval
+        self.checkpoint_interval = checkpoint_interval
+        self.eval_interval = eval_interval
+        self.eval_games = eval_games
+        self.eval_power = eval_power
+        self.writer = CheckpointWriter()
+        self.writer.start()
+        self.eval_pool = multiprocessing.Pool(1, _init_eval_worker) if eval_games > 0 else None
+        self.eval_result = None
+        self.eval_steps = 0
+        self.metrics = open(metrics_path, "a", encoding="utf-8") if metrics_path else None
+        now = time.time()
+        self.start = now
+        self.last_checkpoint = now
+        self.last_eval = now
+        self._reset_window(now, 0, 0)
+        self._rollout_start: Optional[float] = None
+        self._rollout_end: Optional[float] = None
+        self._episode_steps = None
+
+    def _reset_window(self, now: float, steps: int, updates: int) -> None:
+        self.window_start = now
+        self.window_steps = steps
+        self.window_updates = updates
+        self.env_time = 0.0
+        self.learner_time = 0.0
+        self.episodes = 0
+        self.episode_steps_total = 0
+        self.illegal = 0
+
+    def _write(self, entry: dict) -> None:
+        if self.metrics:
+            self.metrics.write(json.dumps(entry) + "\n")
+            self.metrics.flush()
+
+    def _on_rollout_start(self) -> None:
+        now = time.perf_counter()
+        if self._rollout_end is not None:
+            self.learner_time += now - self._rollout_end
+        self._rollout_start = now
+
+    def _on_rollout_end(self) -> None:
+        now = time.perf_counter()
+        self.env_time += now - self._rollout_start
+        self._rollout_end = now
+
+    def _on_training_end(self) -> None:
+        # The gap until the next learn call is neither env nor learner time
+        self._rollout_end = None
+
+    def _on_step(self) -> bool:
+        dones = self.locals["dones"]
+        if self._episode_steps is None:
+            self._episode_steps = [0] * len(dones)
+        for i, (done, info) in enumerate(zip(dones, self.locals["infos"])):
+            self._episode_steps[i] += 1
+            if info.get("illegal"):
+                self.illegal += 1
+            if done:
+                self.episodes += 1
+                self.episode_steps_total += self._episode_steps[i]
+                self._episode_steps[i] = 0
+
+        now = time.time()
+        if now - self.window_start >= self.metrics_interval:
+            self.log_metrics(now)
+        if now - self.last_checkpoint >= self.checkpoint_interval:
+            self.last_checkpoint = now
+            self.writer.save(self.model, self.model_path)
+        self._poll_eval(now)
+        return True
+
+    def log_metrics(self, now: float) -> None:
+        elapsed = max(now - self.window_start, 1e-9)
+        steps = self.model.num_timesteps - self.window_steps
+        updates = self.model._n_updates - self.window_updates
+        busy = max(self.env_time + self.learner_time, 1e-9)
+        entry = {
+            "time": round(now - self.start, 1),
+            "steps": self.model.num_timesteps,
+            "steps_per_sec": round(steps / elapsed, 1),
+            "updates_per_sec": round(updates / elapsed, 1),
+            "env_time": round(self.env_time / busy, 3),
+            "learner_time": round(self.learner_time / busy, 3),
+            "illegal_rate": round(self.illegal / steps, 4) if steps else 0.0,
+            "episodes": self.episodes,
+            "episode_length": round(self.episode_steps_total / self.episodes, 2) if self.episodes else None,
+            "exploration": round(self.model.exploration_rate, 3),
+        }
+        self._write(entry)
+        print(
+            f"{entry['steps']} pas {entry['steps_per_sec']:.0f} pas/s "
+            f"{entry['updates_per_sec']:.0f} mises à jour/s "
+            f"env {entry['env_time']:.0%} apprentissage {entry['learner_time']:.0%} "
+            f"coups illégaux {entry['illegal_rate']:.1%} "
+            f"épisode {entry['episode_length'] or 0:.1f} coups",
+            flush=True,
+        )
+        self._reset_window(now, self.model.num_timesteps, self.model._n_updates)
+
+    def _poll_eval(self, now: float) -> None:
+        if self.eval_pool is None:
+            return
+        if self.eval_result is not None:
+            if not self.eval_result.ready():
+                return
+            result = self.eval_result.get()
+            result["steps"] = self.eval_steps
+            self._write({"time": round(now - self.start, 1), "eval": result})
+            print(
+                f"Évaluation à {self.eval_steps} pas contre minimax power={self.eval_power} : "
+                f"+{result['wins']} ={result['draws']} -{result['losses']} score {result['score']:.2f}",
+                flush=True,
+            )
+            self.eval_result = None
+            self.last_eval = now
+        if now - self.last_eval >= self.eval_interval:
+            # One evaluation at a time; it starts once its snapshot is on disk
+            self.last_eval = float("inf")
+            self.eval_steps = self.model.num_timesteps
+            self.writer.save(self.model, EVAL_MODEL_PATH, self._start_eval)
+
+    def _start_eval(self) -> None:
+        self.eval_result = self.eval_pool.apply_async(
+            evaluate_model, (EVAL_MODEL_PATH, self.eval_games, self.eval_power)
+        )
+
+    def close(self) -> None:
+        # Pending snapshots are written before the final save can replace them
+        self.writer.close()
+        if self.eval_pool is not None:
+            self.eval_pool.terminate()
+        if self.metrics:
+            self.metrics.close()
+
+
+def train_model(
+    max_seconds: int,
+    buffer_size: int = BUFFER_SIZE,
+    buffer_path: str = BUFFER_PATH,
+    metrics_path: Optional[str] = METRICS_PATH,
+    checkpoint_interval: float = CHECKPOINT_INTERVAL,
+    eval_interval: float = EVAL_INTERVAL,
+    eval_games: int = EVAL_GAMES,
+    eval_power: int = EVAL_POWER,
+) -> None:
+    # Started before the model is built so that the evaluation process is
+    # forked without it
+    monitor = TrainingMonitor(
+        MODEL_PATH,
+        metrics_path,
+        checkpoint_interval=checkpoint_interval,
+        eval_interval=eval_interval,
+        eval_games=eval_games,
+        eval_power=eval_power,
+    )
     env = MedChessEnv()
-    model_path = os.path.join(os.path.dirname(__file__), "model.zip")
-    if os.path.exists(model_path):
-        model = DQN.load(model_path, env=env)
+    # The replay buffer lives in its own file and is reopened on every run
+    buffer_args = dict(
+        buffer_size=buffer_size,
+        replay_buffer_class=MmapReplayBuffer,
+        replay_buffer_kwargs={"path": buffer_path},
+    )
+    if os.path.exists(MODEL_PATH):
+        model = DQN.load(MODEL_PATH, env=env, **buffer_args)
     else:
-        model = DQN(MlpPolicy, env, verbose=0)
+        model = DQN(MlpPolicy, env, verbose=0, **buffer_args)
     start = time.time()
-    while True:
-        model.learn(total_timesteps=1000, reset_num_timesteps=False)
-        if time.time() - start >= max_seconds:
-            break
-    model.save(model_path)
+    try:
+        while True:
+            model.learn(total_timesteps=1000, reset_num_timesteps=False, callback=monitor)
+            if time.time() - start >= max_seconds:
+                break
+    finally:
+        monitor.close()
+        model.save(MODEL_PATH)
+        model.replay_buffer.flush()
 
 
 def main() -> None:
@@ -31,8 +305,39 @@ def main() -> None:
         default=30,
         help="Durée maximale d'entraînement en secondes",
     )
+    parser.add_argument(
+        "-buffer",
+        type=int,
+        default=BUFFER_SIZE,
+        help="Nombre de transitions gardées dans la mémoire de rejeu",
+    )
+    parser.add_argument("-buffer-path", default=BUFFER_PATH, help="Fichier de la mémoire de rejeu")
+    parser.add_argument("-metrics", default=METRICS_PATH, help="Fichier JSON lines des mesures d'entraînement")
+    parser.add_argument(
+        "-checkpoint",
+        type=float,
+        default=CHECKPOINT_INTERVAL,
+        help="Secondes entre deux sauvegardes du modèle",
+    )
+    parser.add_argument(
+        "-eval",
+        type=float,
+        default=EVAL_INTERVAL,
+        help="Secondes entre deux évaluations contre le bot minimax",
+    )
+    parser.add_argument("-eval-games", type=int, default=EVAL_GAMES, help="Parties par évaluation (0 la désactive)")
+    parser.add_argument("-eval-power", type=int, default=EVAL_POWER, help="Puissance du bot minimax adverse")
     args = parser.parse_args()
-    train_model(args.max)
+    train_model(
+        args.max,
+        args.buffer,
+        args.buffer_path,
+        metrics_path=args.metrics,
+        checkpoint_interval=args.checkpoint,
+        eval_interval=args.eval,
+        eval_games=args.eval_games,
+        eval_power=args.eval_power,
+    )
 
 
 if __name__ == "__main__":
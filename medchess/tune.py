@@ -0,0 +1,164 @@
+# Texel tuning of the piece-square tables on recorded games
+#
+# Every position of a finished game is labelled with the game result for
+# player 0 (1, 0.5 or 0). The tables are fitted so that
+# sigmoid(k * score) predicts that label, minimising the mean squared error
+# with full-batch Adam steps over all positions at once.
+import argparse
+from typing import Iterable, Optional, Tuple
+
+import numpy as np
+
+from .board import SQUARES
+from .evaluation import MIRROR, PIECE_ORDER, WEIGHTS_PATH, Evaluator
+from .pieces import CASTLE_CODES, PieceType
+from .record import DRAW, read_records, replay
+
+# The castle never moves and both are on the board in every labelled
+# position, so its table has no effect and is left out of the fit
+TUNED = [i for i, ptype in enumerate(PIECE_ORDER) if ptype != PieceType.CASTLE]
+
+
+def load_positions(
+    record_paths: Iterable[str],
+    skip_plies: int = 4,
+    max_positions: Optional[int] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Square codes ``(N, 42)`` and results for player 0 ``(N,)``."""
+    chunks = []
+    results = []
+    total = 0
+    for path in record_paths:
+        for record in read_records(path):
+            if record.result not in (0, 1, DRAW):
+                continue
+            label = 0.5 if record.result == DRAW else 1.0 - record.result
+            buf = bytearray()
+            for ply, (board, _, _) in enumerate(replay(record)):
+                if ply >= skip_plies:
+                    buf += board.cells
+            count = len(buf) // SQUARES
+            if not count:
+                continue
+            chunks.append(np.frombuffer(bytes(buf), dtype=np.uint8).reshape(count, SQUARES))
+            results.append(np.full(count, label, dtype=np.float32))
+            total += count
+            if max_positions is not None and total >= max_positions:
+                break
+        if max_positions is not None and total >= max_positions:
+            break
+    if not chunks:
+        raise ValueError("No finished game found in the records")
+    codes = np.concatenate(chunks)[:max_positions]
+    labels = np.concatenate(results)[:max_positions]
+    # Drop positions where a castle is already gone
+    keep = (codes == CASTLE_CODES[0]).any(axis=1) & (codes == CASTLE_CODES[1]).any(axis=1)
+    return codes[keep], labels[keep]
+
+
+# Parameter and sign of each square code on each square: player 1 pieces use
+# the mirrored square and count negatively. Empty squares and castles point
+# to a last parameter that stays at 0.
+NULL = len(TUNED) * SQUARES
+PARAMS = np.full((9, SQUARES), NULL, dtype=np.intp)
+SIGNS = np.zeros(9, dtype=np.float32)
+for _j, _i in enumerate(TUNED):
+    PARAMS[_i + 1] = _j * SQUARES + np.arange(SQUARES)
+    PARAMS[_i + 5] = _j * SQUARES + MIRROR
+    SIGNS[_i + 1] = 1.0
+    SIGNS[_i + 5] = -1.0
+# Positions per block, bounds the temporary arrays
+BLOCK = 1 << 16
+
+
+def _blocks(codes: np.ndarray) -> Iterable[Tuple[slice, np.ndarray, np.ndarray]]:
+    squares = np.arange(SQUARES)
+    for start in range(0, len(codes), BLOCK):
+        block = codes[start:start + BLOCK]
+        yield slice(start, start + len(block)), PARAMS[block, squares], SIGNS[block]
+
+
+def scores(codes: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    """Score for player 0 of each position with the tuned ``weights``."""
+    w = np.append(weights, 0.0).astype(np.float32)
+    out = np.empty(len(codes), dtype=np.float32)
+    for rows, params, signs in _blocks(codes):
+        out[rows] = (w[params] * signs).sum(axis=1)
+    return out
+
+
+def _sigmoid(z: np.ndarray) -> np.ndarray:
+    return 1.0 / (1.0 + np.exp(-z))
+
+
+def fit_scale(codes: np.ndarray, labels: np.ndarray, weights: np.ndarray) -> float:
+    """Scaling constant k that best maps the current scores to results."""
+    s = scores(codes, weights)
+    candidates = np.geomspace(0.01, 10.0, 200)
+    errors = [np.mean((_sigmoid(k * s) - labels) ** 2) for k in candidates]
+    return float(candidates[int(np.argmin(errors))])
+
+
+def loss_and_gradient(
+    codes: np.ndarray, labels: np.ndarray, weights: np.ndarray, k: float
+) -> Tuple[float, np.ndarray]:
+    w = np.append(weights, 0.0).astype(np.float32)
+    grad = np.zeros(len(w), dtype=np.float64)
+    loss = 0.0
+    for rows, params, signs in _blocks(codes):
+        pred = _sigmoid(k * (w[params] * signs).sum(axis=1))
+        err = pred - labels[rows]
+        loss += float(np.sum(err ** 2))
+        # Each piece adds its sign times the error slope to its parameter
+        slope = err * pred * (1 - pred)
+        grad += np.bincount(params.ravel(), weights=(signs * slope[:, None]).ravel(), minlength=len(w))
+    n = len(codes)
+    return loss / n, (2 * k / n) * grad[:NULL]
+
+
+def tune(
+    codes: np.ndarray,
+    labels: np.ndarray,
+    evaluator: Optional[Evaluator] = None,
+    epochs: int = 500,
+    lr: float = 0.01,
+    verbose: bool = True,
+) -> Evaluator:
+    evaluator = evaluator or Evaluator()
+    tables = evaluator.tables.copy()
+    flat = tables.reshape(len(PIECE_ORDER), SQUARES)
+    weights = flat[TUNED].ravel().astype(np.float64)
+    k = fit_scale(codes, labels, weights)
+    m = np.zeros_like(weights)
+    v = np.zeros_like(weights)
+    beta1, beta2 = 0.9, 0.999
+    for step in range(1, epochs + 1):
+        loss, grad = loss_and_gradient(codes, labels, weights, k)
+        m = beta1 * m + (1 - beta1) * grad
+        v = beta2 * v + (1 - beta2) * grad ** 2
+        weights -= lr * (m / (1 - beta1 ** step)) / (np.sqrt(v / (1 - beta2 ** step)) + 1e-8)
+        if verbose and (step == 1 or step % 50 == 0):
+            print(f"epoch {step} erreur {loss:.5f}")
+    flat[TUNED] = weights.reshape(len(TUNED), SQUARES)
+    return Evaluator(tables)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Ajuste les tables d'évaluation sur des parties enregistrées")
+    parser.add_argument("records", nargs="+", help="Fichiers de parties")
+    parser.add_argument("-out", default=WEIGHTS_PATH, help="Fichier de poids à écrire")
+    parser.add_argument("-epochs", type=int, default=500, help="Nombre de pas d'optimisation")
+    parser.add_argument("-lr", type=float, default=0.01, help="Pas d'apprentissage")
+    parser.add_argument("-skip", type=int, default=4, help="Demi-coups d'ouverture ignorés dans chaque partie")
+    parser.add_argument("-max-positions", type=int, default=None, help="Nombre maximal de positions")
+    args = parser.parse_args()
+
+    codes, labels = load_positions(args.records, args.skip, args.max_positions)
+    print(f"{len(labels)} positions")
+    evaluator = tune(codes, labels, epochs=args.epochs, lr=args.lr)
+    evaluator.save(args.out)
+    print(f"Poids écrits dans {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+# Zobrist hashing of MedChess positions
+import random
+
+from .board import Board, Move, BOARD_WIDTH, SQUARES
+
+# Fixed seed: hashes are stored on disk by the position index
+_rng = random.Random(0x4D656443)
+PIECE_KEYS = [
+    [0] + [_rng.getrandbits(64) for _ in range(8)]
+    for _ in range(SQUARES)
+]
+SIDE_KEY = _rng.getrandbits(64)
+
+
+def position_hash(board: Board, player: int) -> int:
+    h = SIDE_KEY if player else 0
+    for square, code in enumerate(board.cells):
+        if code:
+            h ^= PIECE_KEYS[square][code]
+    return h
+
+
+def update_hash(h: int, board: Board, move: Move) -> int:
+    """Hash after ``move``, computed from the board before it is played."""
+    fr, fc, tr, tc = move
+    src = fr * BOARD_WIDTH + fc
+    dst = tr * BOARD_WIDTH + tc
+    code = board.cells[src]
+    # PIECE_KEYS[dst][0] is 0, so an empty target leaves the hash unchanged
+    return h ^ PIECE_KEYS[src][code] ^ PIECE_KEYS[dst][code] ^ PIECE_KEYS[dst][board.cells[dst]] ^ SIDE_KEY